@@ -0,0 +1,358 @@
+# -*- coding:utf-8 -*-
+'''
+Benchmarks ijson backends on generated JSON documents of different shapes.
+
+Every combination of backend, layer (basic_parse, parse, items) and corpus is
+run in a separate process so that peak memory figures aren't polluted by
+previous runs. Results are printed as a table and can be saved as JSON to be
+compared against a later run:
+
+    python bench.py --save before.json
+    # ... hack ...
+    python bench.py --compare before.json
+
+`--compare` exits with a non-zero status if any case got slower than the
+allowed threshold.
+
+Scaling on a single huge string value can be checked by running the
+"bigstring" corpus alone at growing sizes:
+
+    python bench.py --corpus bigstring --size 16
+'''
+import json
+import optparse
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BACKENDS = ['python', 'yajl']
+LAYERS = ['basic_parse', 'parse', 'items']
+
+
+def _fill(f, size, item):
+    '''
+    Writes a JSON array of items produced by `item(n)` into `f` until the
+    document is at least `size` bytes long.
+    '''
+    f.write('[')
+    written = 1
+    n = 0
+    while written < size:
+        chunk = (',' if n else '') + item(n)
+        f.write(chunk)
+        written += len(chunk)
+        n += 1
+    f.write(']')
+
+def flat_corpus(f, size, rnd):
+    scalars = ['null', 'true', 'false', '0', '-1', '"a"', '""', '12345']
+    _fill(f, size, lambda n: rnd.choice(scalars))
+    return 'item'
+
+NESTING_DEPTH = 32
+
+def nested_corpus(f, size, rnd):
+    head = '{"a":' * NESTING_DEPTH
+    tail = '}' * NESTING_DEPTH
+    _fill(f, size, lambda n: '%s{"v":%d}%s' % (head, n, tail))
+    return '.'.join(['item'] + ['a'] * NESTING_DEPTH)
+
+def strings_corpus(f, size, rnd):
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', r'quote\"d', r'ст']
+    def item(n):
+        return '{"name":"%s","text":"%s"}' % (
+            rnd.choice(words),
+            ' '.join(rnd.choice(words) for i in range(rnd.randint(5, 40))),
+        )
+    _fill(f, size, item)
+    return 'item'
+
+def numbers_corpus(f, size, rnd):
+    def item(n):
+        if n % 2:
+            return str(rnd.randint(-10 ** 9, 10 ** 9))
+        return '%.6f' % rnd.uniform(-1000, 1000)
+    _fill(f, size, item)
+    return 'item'
+
+def bigstring_corpus(f, size, rnd):
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+    f.write('{"blob":"')
+    line = ''.join(rnd.choice(alphabet) for i in range(76))
+    for i in range(size // len(line)):
+        f.write(line)
+    f.write('"}')
+    return 'blob'
+
+def depth_document(depth, size):
+    '''
+    An array of maps nested `depth` levels deep with a few scalar members on
+    every level, for measuring the cost of prefix maintenance against depth.
+    '''
+    level = '{"a":1,"b":"x","c":null,"d":%s}'
+    inner = '0'
+    for i in range(depth):
+        inner = level % inner
+    count = max(1, size // len(inner))
+    return '[%s]' % ','.join([inner] * count)
+
+CORPORA = [
+    ('flat', flat_corpus),
+    ('nested', nested_corpus),
+    ('strings', strings_corpus),
+    ('numbers', numbers_corpus),
+    ('bigstring', bigstring_corpus),
+]
+
+
+def load_backend(name):
+    __import__('ijson.backends.%s' % name)
+    return sys.modules['ijson.backends.%s' % name]
+
+def available_backends(names):
+    result = []
+    for name in names:
+        try:
+            load_backend(name)
+        except Exception, e:
+            sys.stderr.write('Skipping backend %s: %s\n' % (name, e))
+        else:
+            result.append(name)
+    return result
+
+def peak_rss():
+    '''
+    Peak resident set size of the current process in kilobytes.
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+def count_events(path):
+    from ijson.backends import python
+    f = open(path, 'rb')
+    try:
+        return sum(1 for event in python.basic_parse(f))
+    finally:
+        f.close()
+
+def run_case(backend_name, layer, path, prefix):
+    '''
+    Runs a single benchmark case in the current process and returns its
+    measurements. Meant to be called in a fresh process (see `--worker`).
+    '''
+    backend = load_backend(backend_name)
+    base_rss = peak_rss()
+    f = open(path, 'rb')
+    try:
+        start = time.time()
+        if layer == 'basic_parse':
+            iterator = backend.basic_parse(f)
+        elif layer == 'parse':
+            iterator = backend.parse(f)
+        else:
+            iterator = backend.items(f, prefix)
+        count = 0
+        for value in iterator:
+            count += 1
+        seconds = time.time() - start
+    finally:
+        f.close()
+    return {
+        'count': count,
+        'seconds': seconds,
+        'peak_rss_kb': peak_rss() - base_rss,
+    }
+
+def spawn_case(backend_name, layer, path, prefix):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--worker',
+         backend_name, layer, path, prefix],
+        stdout=subprocess.PIPE,
+    )
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise Exception('%s/%s failed on %s' % (backend_name, layer, path))
+    return json.loads(output)
+
+def run(options):
+    backends = available_backends(options.backends)
+    layers = options.layers
+    corpora = [(name, func) for name, func in CORPORA if name in options.corpora]
+    rnd = random.Random(options.seed)
+    tmpdir = tempfile.mkdtemp(prefix='ijson-bench-')
+    results = []
+    try:
+        for corpus, generate in corpora:
+            path = os.path.join(tmpdir, corpus + '.json')
+            f = open(path, 'wb')
+            try:
+                prefix = generate(f, int(options.size * 1024 * 1024), rnd)
+            finally:
+                f.close()
+            size = os.path.getsize(path)
+            events = count_events(path)
+            for backend_name in backends:
+                for layer in layers:
+                    best = None
+                    for i in range(options.repeat):
+                        case = spawn_case(backend_name, layer, path, prefix)
+                        if best is None or case['seconds'] < best['seconds']:
+                            best = case
+                    seconds = max(best['seconds'], 1e-9)
+                    result = {
+                        'backend': backend_name,
+                        'layer': layer,
+                        'corpus': corpus,
+                        'bytes': size,
+                        'events': events,
+                        'yielded': best['count'],
+                        'seconds': seconds,
+                        'events_per_sec': events / seconds,
+                        'mb_per_sec': size / seconds / 1024 / 1024,
+                        'peak_rss_kb': best['peak_rss_kb'],
+                    }
+                    results.append(result)
+                    report(result)
+    finally:
+        shutil.rmtree(tmpdir)
+    return {
+        'meta': {
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'size_mb': options.size,
+            'repeat': options.repeat,
+            'seed': options.seed,
+        },
+        'results': results,
+    }
+
+def run_depths(options):
+    '''
+    Times `common.parse` alone over pre-recorded events of documents of
+    increasing nesting depth.
+    '''
+    from StringIO import StringIO
+    from ijson import common
+    from ijson.backends import python
+    results = []
+    for depth in options.depths:
+        document = depth_document(depth, int(options.size * 1024 * 1024))
+        events = list(python.basic_parse(StringIO(document)))
+        best = None
+        for i in range(options.repeat):
+            start = time.time()
+            for item in common.parse(events):
+                pass
+            seconds = max(time.time() - start, 1e-9)
+            best = seconds if best is None else min(best, seconds)
+        result = {
+            'backend': 'events',
+            'layer': 'parse',
+            'corpus': 'depth-%d' % depth,
+            'bytes': len(document),
+            'events': len(events),
+            'yielded': len(events),
+            'seconds': best,
+            'events_per_sec': len(events) / best,
+            'mb_per_sec': len(document) / best / 1024 / 1024,
+            'peak_rss_kb': 0,
+        }
+        results.append(result)
+        report(result)
+    return results
+
+def case_key(result):
+    return (result['backend'], result['layer'], result['corpus'])
+
+def report(result):
+    print '%-8s %-12s %-10s %12.0f ev/s %8.2f MB/s %8d KB' % (
+        result['backend'], result['layer'], result['corpus'],
+        result['events_per_sec'], result['mb_per_sec'], result['peak_rss_kb'],
+    )
+
+def compare(baseline, current, threshold):
+    '''
+    Prints relative speed of current results against a baseline and returns
+    a list of cases that got slower by more than `threshold` (a fraction).
+    '''
+    old = dict((case_key(r), r) for r in baseline['results'])
+    regressions = []
+    print
+    print 'Compared to %s:' % baseline['meta']['time']
+    for result in current['results']:
+        key = case_key(result)
+        if key not in old:
+            continue
+        ratio = result['mb_per_sec'] / old[key]['mb_per_sec']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print '%-8s %-12s %-10s %6.2fx%s' % (key + (ratio, flag))
+    return regressions
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--backend', dest='backends', action='append',
+                      help='backend to run (may be repeated), default: all')
+    parser.add_option('--layer', dest='layers', action='append',
+                      help='layer to run (may be repeated), default: all')
+    parser.add_option('--corpus', dest='corpora', action='append',
+                      help='corpus to run (may be repeated), default: all')
+    parser.add_option('--size', type='float', default=2,
+                      help='approximate size of each corpus in MB [%default]')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs per case, the best one is reported [%default]')
+    parser.add_option('--seed', type='int', default=0,
+                      help='random seed for corpus generation [%default]')
+    parser.add_option('--depths', metavar='N,N,...',
+                      help='also time common.parse alone on documents of '
+                           'these nesting depths')
+    parser.add_option('--save', metavar='FILE', help='save results as JSON')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare results with a previously saved run')
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help='slowdown fraction reported as regression [%default]')
+    parser.add_option('--worker', action='store_true', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.worker:
+        print json.dumps(run_case(*args))
+        return 0
+
+    options.backends = options.backends or BACKENDS
+    options.layers = options.layers or LAYERS
+    options.corpora = options.corpora or [name for name, func in CORPORA]
+    options.depths = [int(d) for d in (options.depths or '').split(',') if d]
+    results = run(options)
+    if options.depths:
+        results['results'].extend(run_depths(options))
+    if options.save:
+        f = open(options.save, 'w')
+        try:
+            json.dump(results, f, indent=2)
+        finally:
+            f.close()
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        if compare(baseline, results, options.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
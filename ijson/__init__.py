@@ -1,2 +1,2 @@
 from ijson.common import JSONError, IncompleteJSONError, ObjectBuilder
-from ijson.backends.yajl import  basic_parse, parse, items
+from ijson.backends.yajl import  basic_parse, parse, items, multi_items, route_items
@@ -0,0 +1,122 @@
+'''
+Parsing of input read from asyncio streams without blocking the event loop,
+for Python 2 with the trollius port of asyncio.
+
+Input is read with the `read` coroutine of a StreamReader (or anything
+having it) and every chunk is passed to a push parser of a backend (see
+`basic_parse_coro`). What's parsed is returned from `next_batch` as a list
+per chunk, and None at the end of input:
+
+    @trollius.coroutine
+    def handle(reader, writer):
+        objects = items_async(reader, 'earth.europe.item')
+        while True:
+            batch = yield From(objects.next_batch())
+            if batch is None:
+                break
+            for o in batch:
+                do_something_with(o)
+
+Parsing a chunk can be moved to an executor by passing one (or True for the
+default executor of the loop), so that large chunks don't hold up other
+coroutines.
+'''
+from ijson import utils
+from ijson.backends import backend_name, load_backend
+
+try:
+    import trollius
+    from trollius import From, Return
+except ImportError:
+    trollius = None
+
+
+BUFSIZE = 64 * 1024
+
+
+def coroutine(func):
+    if trollius is None:
+        return func
+    return trollius.coroutine(func)
+
+class Parsed(object):
+    '''
+    Events or objects produced by a push parser fed with input from an
+    asyncio stream. `make_parser` is called with a target collecting them,
+    e.g. `lambda target: backend.items_coro(target, prefix)`.
+    '''
+    def __init__(self, reader, make_parser, buf_size=BUFSIZE, executor=None, loop=None):
+        self.reader = reader
+        self.results = utils.SendableList()
+        self.parser = make_parser(self.results)
+        self.buf_size = buf_size
+        self.executor = executor
+        self.loop = loop
+        self.done = False
+
+    def feed(self, data):
+        '''
+        Parses a chunk of input, an empty one ending it, and returns a list
+        of what's been parsed from it.
+        '''
+        self.parser.send(data)
+        if not data:
+            self.done = True
+        batch = list(self.results)
+        del self.results[:]
+        return batch
+
+    @coroutine
+    def next_batch(self):
+        '''
+        Reads input until something is parsed and returns a list of it, or
+        None once input has ended.
+        '''
+        if trollius is None:
+            raise ImportError('Reading asyncio streams requires trollius')
+        while not self.done:
+            data = yield From(self.reader.read(self.buf_size))
+            if self.executor is None:
+                batch = self.feed(data)
+            else:
+                loop = self.loop or trollius.get_event_loop()
+                executor = None if self.executor is True else self.executor
+                batch = yield From(loop.run_in_executor(executor, self.feed, data))
+            if batch:
+                raise Return(batch)
+        raise Return(None)
+
+def basic_parse_async(reader, backend='python', buf_size=BUFSIZE, executor=None,
+                      loop=None, **kwargs):
+    '''
+    Returns Parsed basic events of input from an asyncio stream. Keyword
+    arguments are passed to the backend's `basic_parse_coro`.
+    '''
+    backend = load_backend(backend_name(backend))
+    return Parsed(
+        reader, lambda target: backend.basic_parse_coro(target, **kwargs),
+        buf_size, executor, loop,
+    )
+
+def parse_async(reader, backend='python', buf_size=BUFSIZE, executor=None,
+                loop=None, **kwargs):
+    '''
+    Returns Parsed events with prefixes of input from an asyncio stream.
+    '''
+    backend = load_backend(backend_name(backend))
+    return Parsed(
+        reader, lambda target: backend.parse_coro(target, **kwargs),
+        buf_size, executor, loop,
+    )
+
+def items_async(reader, prefix, backend='python', buf_size=BUFSIZE, executor=None,
+                loop=None, **kwargs):
+    '''
+    Returns Parsed objects found under a prefix (which may be a pattern) in
+    input from an asyncio stream.
+    '''
+    backend = load_backend(backend_name(backend))
+    return Parsed(
+        reader, lambda target: backend.items_coro(target, prefix, **kwargs),
+        buf_size, executor, loop,
+    )
@@ -0,0 +1,18 @@
+import sys
+
+
+def backend_name(backend):
+    '''
+    Returns the module name of a backend given by name (e.g. "python") or
+    as a module.
+    '''
+    if isinstance(backend, basestring):
+        return 'ijson.backends.%s' % backend
+    return backend.__name__
+
+def load_backend(name):
+    '''
+    Imports a backend by its module name and returns the module.
+    '''
+    __import__(name)
+    return sys.modules[name]
@@ -1,24 +1,84 @@
-from decimal import Decimal
+import codecs
+from collections import deque
+from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+import mmap
 import re
 
-from ijson import common
+from ijson import common, streams, utils
 
 
-BUFSIZE = 4 * 1024
+BUFSIZE = 64 * 1024
+BATCH_SIZE = 1024
 NONWS = re.compile(r'\S')
-NUMTERM = re.compile(r'[^0-9\.-]')
+NUMTERM = re.compile(r'[^0-9\.eE+-]')
 ALPHATERM = re.compile(r'[^a-z]')
+STRINGTERM = re.compile(r'[\\"]')
+ATOMSTART = re.compile(r'[a-z0-9-]')
+# anything but brackets, with whole strings skipped at once
+SKIPPABLE = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
 
 
+def closing_quote(buffer, start, backslashes=0):
+    '''
+    Finds the quote closing a string in `buffer` from `start` on. A quote
+    preceded by an odd number of backslashes is escaped, and `backslashes`
+    of them may precede `start` in earlier buffers. Returns the position of
+    the quote (or -1) and the number of backslashes ending the buffer to
+    continue the search in the next one.
+    '''
+    while True:
+        end = buffer.find('"', start)
+        if end == -1:
+            break
+        escpos = end - 1
+        while escpos >= start and buffer[escpos] == '\\':
+            escpos -= 1
+        count = end - 1 - escpos
+        if escpos < start:
+            count += backslashes
+        if not count % 2:
+            return end, 0
+        start = end + 1
+        backslashes = 0
+    escpos = len(buffer) - 1
+    while escpos >= start and buffer[escpos] == '\\':
+        escpos -= 1
+    if escpos < start:
+        backslashes += len(buffer) - start
+    else:
+        backslashes = len(buffer) - 1 - escpos
+    return -1, backslashes
+
 class Reader(object):
-    def __init__(self, f):
+    '''
+    Splits input into JSON lexems. Only one chunk of input is held in the
+    buffer at a time. A lexem spanning several chunks is gathered as a list
+    of pieces joined once it's complete, so long strings cost linear time.
+
+    A memory-mapped file (or a string) is used as the buffer itself, and only
+    lexems are copied out of it.
+
+    `offset` is the position of the buffer in the input, so the current
+    position in the input is `offset + pos`.
+    '''
+    def __init__(self, f, buf_size=BUFSIZE):
         self.f = f
+        self.buf_size = buf_size
+        self.mapped = isinstance(f, (mmap.mmap, str))
 
     def __iter__(self):
-        self.buffer = ''
+        self.buffer = self.f if self.mapped else ''
         self.pos = 0
+        self.offset = 0
         return self
 
+    def read(self):
+        self.offset += len(self.buffer)
+        if self.mapped:
+            return ''
+        return self.f.read(self.buf_size)
+
     def next(self):
         while True:
             match = NONWS.search(self.buffer, self.pos)
@@ -30,127 +90,716 @@ class Reader(object):
                 elif '0' <= char <= '9' or char == '-':
                     return self.lexem(NUMTERM)
                 elif char == '"':
-                    self.pos += 1
-                    return '"' + self.stringlexem()
+                    return self.stringlexem()
                 else:
                     self.pos += 1
                     return char
-            self.buffer = self.f.read(BUFSIZE)
+            self.buffer = self.read()
             self.pos = 0
             if not len(self.buffer):
                 raise common.IncompleteJSONError()
 
     def lexem(self, pattern):
-        current = self.pos
+        match = pattern.search(self.buffer, self.pos)
+        if match:
+            end = match.start()
+            result = self.buffer[self.pos:end]
+            self.pos = end
+            return result
+        pieces = [self.buffer[self.pos:]]
         while True:
-            match = pattern.search(self.buffer, current)
+            self.buffer = self.read()
+            self.pos = 0
+            if not self.buffer:
+                break
+            match = pattern.search(self.buffer)
             if match:
-                current = match.start()
+                self.pos = match.start()
+                pieces.append(self.buffer[:self.pos])
                 break
+            pieces.append(self.buffer)
+        return ''.join(pieces)
+
+    def stringlexem(self):
+        '''
+        Returns a string lexem starting at the current position, including
+        both quotes.
+        '''
+        pieces = []
+        backslashes = 0 # trailing backslashes of the pieces gathered so far
+        start = self.pos + 1
+        while True:
+            end, backslashes = closing_quote(self.buffer, start, backslashes)
+            if end != -1:
+                result = self.buffer[self.pos:end + 1]
+                self.pos = end + 1
+                if pieces:
+                    pieces.append(result)
+                    return ''.join(pieces)
+                return result
+            pieces.append(self.buffer[self.pos:])
+            self.buffer = self.read()
+            self.pos = start = 0
+            if not self.buffer:
+                raise common.IncompleteJSONError()
+
+    def refill(self):
+        '''
+        Replaces the buffer with the next chunk of input. Used when skipping
+        values, so nothing from the current buffer needs to be kept.
+        '''
+        self.pos -= len(self.buffer)
+        self.buffer = self.read()
+        if not self.buffer:
+            raise common.IncompleteJSONError()
+
+    def skipstring(self):
+        while True:
+            match = STRINGTERM.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                self.refill()
+            elif match.group() == '"':
+                self.pos = match.end()
+                return
             else:
-                current = len(self.buffer)
-                self.buffer += self.f.read(BUFSIZE)
-                if len(self.buffer) == current:
-                    break
-        result = self.buffer[self.pos:current]
-        self.pos = current
-        if self.pos > BUFSIZE:
-            self.buffer = self.buffer[self.pos:]
-            self.pos = 0
-        return result
+                # skip the escaped character, possibly in the next chunk
+                self.pos = match.end() + 1
+                if self.pos > len(self.buffer):
+                    self.refill()
+
+    def skipcontainer(self):
+        '''
+        Skips the rest of an array or an object whose opening bracket has
+        already been read. Only bracket balance and string boundaries are
+        tracked, so the skipped data isn't validated.
+        '''
+        depth = 1
+        while depth:
+            pos = SKIPPABLE.match(self.buffer, self.pos).end()
+            if pos == len(self.buffer):
+                self.pos = pos
+                self.refill()
+                continue
+            char = self.buffer[pos]
+            self.pos = pos + 1
+            if char == '"':
+                # a string that doesn't end in this buffer
+                self.skipstring()
+            elif char == '[' or char == '{':
+                depth += 1
+            else:
+                depth -= 1
+
+    def skipvalue(self):
+        while True:
+            match = NONWS.search(self.buffer, self.pos)
+            if match:
+                break
+            self.pos = len(self.buffer)
+            self.refill()
+        self.pos = match.start()
+        char = self.buffer[self.pos]
+        if char == '"':
+            self.pos += 1
+            self.skipstring()
+        elif char == '[' or char == '{':
+            self.pos += 1
+            self.skipcontainer()
+        elif 'a' <= char <= 'z' or '0' <= char <= '9' or char == '-':
+            self.next()
+        else:
+            raise common.JSONError('Unexpected symbol')
+
+class StreamingReader(Reader):
+    '''
+    A Reader that doesn't gather strings longer than `limit` bytes. Lexing
+    such a string stops early returning a lone quote, and the rest of the
+    string is left in `rest` as an iterator over its raw pieces. If nobody
+    reads them, they are skipped on the way to the next lexem.
+    '''
+    def __init__(self, f, buf_size=BUFSIZE, limit=BUFSIZE):
+        super(StreamingReader, self).__init__(f, buf_size)
+        self.limit = limit
+        self.rest = None
+
+    def next(self):
+        if self.rest is not None:
+            for piece in self.rest:
+                pass
+            self.rest = None
+        return super(StreamingReader, self).next()
 
     def stringlexem(self):
+        end = self.buffer.find('"', self.pos + 1)
+        if end != -1 and end - self.pos <= self.limit and '\\' not in self.buffer[self.pos:end]:
+            result = self.buffer[self.pos:end + 1]
+            self.pos = end + 1
+            return result
+        self.pos += 1
+        pieces = []
+        size = 0
+        rest = self.stringpieces()
+        for piece in rest:
+            pieces.append(piece)
+            size += len(piece)
+            if size > self.limit:
+                self.rest = chain(pieces, rest)
+                return '"'
+        return '"%s"' % ''.join(pieces)
+
+    def slices(self, start, end):
+        for pos in xrange(start, end, self.buf_size):
+            yield self.buffer[pos:min(end, pos + self.buf_size)]
+
+    def stringpieces(self):
+        '''
+        Yields raw pieces of a string from the current position to the
+        closing quote, which is consumed but not included. Pieces are at
+        most `buf_size` bytes long. Quotes are told from escaped ones the
+        same way as in `stringlexem`.
+        '''
         start = self.pos
+        backslashes = 0 # trailing backslashes of the previous buffers
         while True:
+            end, backslashes = closing_quote(self.buffer, start, backslashes)
+            if end != -1:
+                for piece in self.slices(start, end):
+                    yield piece
+                self.pos = end + 1
+                return
+            for piece in self.slices(start, len(self.buffer)):
+                yield piece
+            self.pos = len(self.buffer)
+            self.refill()
+            start = self.pos
+
+def unescape(value):
+    '''
+    Decodes a string lexem. Most strings don't contain escapes and are simply
+    decoded from utf-8. Otherwise non-ascii characters are turned into escapes
+    too so that the whole string can be decoded with "unicode-escape".
+    '''
+    if '\\' not in value:
+        return value.decode('utf-8')
+    return value.decode('utf-8').encode('ascii', 'backslashreplace').decode('unicode-escape')
+
+def unescape_pieces(pieces):
+    '''
+    Decodes raw pieces of a string into unicode pieces. Utf-8 sequences,
+    escapes and surrogate pairs split between pieces are carried over to the
+    next one.
+    '''
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = u''
+    high = u'' # a high surrogate waiting for its pair
+    for piece in pieces:
+        text = tail + decoder.decode(piece)
+        # an escape starts at a backslash following anything else, and
+        # escapes are at most 6 characters long
+        cut = text.rfind('\\', max(0, len(text) - 6))
+        if cut == -1:
+            tail = u''
+        else:
+            while cut and text[cut - 1] == '\\':
+                cut -= 1
+            text, tail = text[:cut], text[cut:]
+        if '\\' in text:
+            text = text.encode('ascii', 'backslashreplace').decode('unicode-escape')
+        text = high + text
+        if text and u'\ud800' <= text[-1] <= u'\udbff':
+            text, high = text[:-1], text[-1]
+        else:
+            high = u''
+        if text:
+            yield text
+    text = tail + decoder.decode('', True)
+    if '\\' in text:
+        text = text.encode('ascii', 'backslashreplace').decode('unicode-escape')
+    text = high + text
+    if text:
+        yield text
+
+def parse_value(f, symbol=None, number=common.number):
+    '''
+    Yields events of a value starting with `symbol` (or with the next symbol
+    of the reader). Open containers are kept on an explicit stack (True for
+    maps, False for arrays) instead of recursion, so events are yielded
+    directly at any depth.
+    '''
+    if symbol is None:
+        symbol = f.next()
+    stack = []
+    key = False
+    while True:
+        if symbol == '{':
+            yield ('start_map', None)
+            symbol = f.next()
+            if symbol == '}':
+                yield ('end_map', None)
+            else:
+                stack.append(True)
+                key = True
+        elif symbol == '[':
+            yield ('start_array', None)
+            symbol = f.next()
+            if symbol == ']':
+                yield ('end_array', None)
+            else:
+                stack.append(False)
+                continue
+        elif symbol[0] == '"':
+            yield ('string', unescape(symbol[1:-1]))
+        elif symbol == 'null':
+            yield ('null', None)
+        elif symbol == 'true':
+            yield ('boolean', True)
+        elif symbol == 'false':
+            yield ('boolean', False)
+        else:
             try:
-                end = self.buffer.index('"', start)
-                escpos = end - 1
-                while self.buffer[escpos] == '\\':
-                    escpos -= 1
-                if (end - escpos) % 2 == 0:
-                    start = end + 1
+                yield ('number', number(symbol))
+            except (ValueError, InvalidOperation):
+                raise common.JSONError('Unexpected symbol')
+        # after a value: close containers until the next value is found
+        while stack:
+            if key:
+                key = False
+            else:
+                symbol = f.next()
+                if symbol == ',':
+                    symbol = f.next()
+                    if not stack[-1]:
+                        if symbol == ']':
+                            raise common.JSONError('Unexpected symbol')
+                        break
+                elif symbol == '}' and stack[-1]:
+                    stack.pop()
+                    yield ('end_map', None)
+                    continue
+                elif symbol == ']' and not stack[-1]:
+                    stack.pop()
+                    yield ('end_array', None)
+                    continue
                 else:
-                    result = self.buffer[self.pos:end + 1]
-                    self.pos = end + 1
-                    return result
-            except ValueError:
-                old_len = len(self.buffer)
-                self.buffer += self.f.read(BUFSIZE)
-                if len(self.buffer) == old_len:
-                    raise common.IncompleteJSONError()
-
-def parse_value(f, symbol=None):
-    if symbol == None:
-        symbol = f.next()
-    if symbol == 'null':
-        yield ('null', None)
-    elif symbol == 'true':
-        yield ('boolean', True)
-    elif symbol == 'false':
-        yield ('boolean', False)
-    elif symbol == '[':
-        for event in parse_array(f):
-            yield event
-    elif symbol == '{':
-        for event in parse_object(f):
-            yield event
-    elif symbol[0] == '"':
-        yield ('string', symbol[1:-1].decode('unicode-escape'))
-    else:
-        try:
-            number = Decimal(symbol) if '.' in symbol else int(symbol)
-            yield ('number', number)
-        except ValueError:
-            raise common.JSONError('Unexpected symbol')
+                    raise common.JSONError('Unexpected symbol')
+            if symbol[0] != '"':
+                raise common.JSONError('Unexpected symbol')
+            yield ('map_key', symbol[1:-1])
+            if f.next() != ':':
+                raise common.JSONError('Unexpected symbol')
+            symbol = f.next()
+            break
+        else:
+            return
+
+def value_span(f, symbol, number):
+    '''
+    Skips a value instead of parsing it and yields its position in the input
+    as a ('span', (start, end)) event.
+    '''
+    start = f.offset + f.pos - len(symbol)
+    if symbol == '[' or symbol == '{':
+        f.skipcontainer()
+    yield ('span', (start, f.offset + f.pos))
 
-def parse_array(f):
-    yield ('start_array', None)
-    expect_comma = False
+def parse_selected(f, symbol, state, number, value=parse_value):
+    '''
+    Parses a value at a position described by a MatchState producing only
+    events for values matched by the PrefixMatcher and for the containers
+    leading to them. Everything else is skipped by the reader without
+    decoding strings and numbers or yielding events. Matched values are
+    parsed by `value`.
+
+    Like parse_value it keeps open containers on a stack, as pairs of
+    whether a container is a map and the state of the map or of the items
+    of the array.
+    '''
+    stack = []
+    key = False
     while True:
-        symbol = f.next()
-        if symbol == ']':
-            break
-        if expect_comma:
-            if symbol != ',':
+        if state.matches:
+            for event in value(f, symbol, number):
+                yield event
+        elif symbol == '[':
+            yield ('start_array', None)
+            child = state.child('item')
+            if not child.alive:
+                f.skipcontainer()
+                yield ('end_array', None)
+            else:
+                symbol = f.next()
+                if symbol == ']':
+                    yield ('end_array', None)
+                else:
+                    stack.append((False, child))
+                    state = child
+                    continue
+        elif symbol == '{':
+            yield ('start_map', None)
+            symbol = f.next()
+            if symbol == '}':
+                yield ('end_map', None)
+            else:
+                stack.append((True, state))
+                key = True
+        elif state.scalars:
+            # matched only by scalar patterns
+            for event in parse_value(f, symbol, number):
+                yield event
+        while stack:
+            is_map, container = stack[-1]
+            if key:
+                key = False
+            else:
+                symbol = f.next()
+                if symbol == ',':
+                    symbol = f.next()
+                    if not is_map:
+                        if symbol == ']':
+                            raise common.JSONError('Unexpected symbol')
+                        state = container
+                        break
+                elif symbol == '}' and is_map:
+                    stack.pop()
+                    yield ('end_map', None)
+                    continue
+                elif symbol == ']' and not is_map:
+                    stack.pop()
+                    yield ('end_array', None)
+                    continue
+                else:
+                    raise common.JSONError('Unexpected symbol')
+            if symbol[0] != '"':
+                raise common.JSONError('Unexpected symbol')
+            if symbol == '"':
+                # a key cut short by a StreamingReader
+                name = ''.join(f.rest)
+                f.rest = None
+            else:
+                name = symbol[1:-1]
+            if f.next() != ':':
                 raise common.JSONError('Unexpected symbol')
+            state = container.child(name)
+            if state.alive:
+                yield ('map_key', name)
+                symbol = f.next()
+                break
+            f.skipvalue()
         else:
-            for event in parse_value(f, symbol):
-                yield event
-        expect_comma = not expect_comma
-    yield ('end_array', None)
+            return
 
-def parse_object(f):
-    yield ('start_map', None)
+def long_strings(events, f, sink=None):
+    '''
+    Replaces string events for strings cut short by a StreamingReader with
+    ('start_string', None), ('string_chunk', <unicode>)... and
+    ('end_string', None) events, or, if `sink` is given, with a string event
+    with the value returned by sink() after the string has been written into
+    it encoded in utf-8. Map keys are gathered whole.
+    '''
+    for event, value in events:
+        if f.rest is None:
+            yield event, value
+            continue
+        rest = f.rest
+        if event == 'map_key':
+            yield event, ''.join(rest)
+        elif sink is not None:
+            out = sink()
+            for piece in unescape_pieces(rest):
+                out.write(piece.encode('utf-8'))
+            yield event, out
+        else:
+            yield 'start_string', None
+            for piece in unescape_pieces(rest):
+                yield 'string_chunk', piece
+            yield 'end_string', None
+        f.rest = None
+
+def value_starts(f):
+    '''
+    Yields first symbols of values following each other until the input ends.
+    '''
     while True:
-        symbol = f.next()
-        if symbol[0] != '"':
-            raise common.JSONError('Unexpected symbol')
-        yield ('map_key', symbol[1:-1])
-        symbol = f.next()
-        if symbol != ':':
-            raise common.JSONError('Unexpected symbol')
-        for event in parse_value(f):
+        try:
+            yield f.next()
+        except common.IncompleteJSONError:
+            return
+
+def basic_parse(f, buf_size=BUFSIZE, select=None, number=Decimal, intern_keys=0,
+                multiple_values=False, stats=None,
+                decompress_in_thread=False, max_string_size=None,
+                string_sink=None):
+    '''
+    Iterator yielding unprefixed events.
+
+    Parameters:
+
+    - f: a readable file-like object with JSON input, a path to a file or
+      an mmap object; files given by path are memory-mapped
+    - buf_size: a size of an input buffer
+    - select: a prefix, a collection of prefixes or a PrefixMatcher; when
+      given, only events for values under them and for the containers
+      leading to them are produced while everything else is skipped without
+      decoding. Prefixes may be patterns (see common.PrefixMatcher).
+    - number: how to represent numbers with a fraction or an exponent:
+      Decimal (default) or float, or common.RawNumber to keep the text of
+      every number and convert it only when it's read
+    - intern_keys: if non-zero, up to this many distinct map keys are cached
+      so that equal keys throughout the document share one string object
+    - multiple_values: if True, input may contain any number of values
+      separated by whitespace (e.g. JSON lines), and events of all of them
+      are produced one after another
+    - stats: a common.Stats instance to collect statistics of parsing into
+    - decompress_in_thread: input compressed with gzip, bz2 or xz is
+      recognized and decompressed (see streams.open_input), in a background
+      thread if this is True
+    - max_string_size: if given, string values longer than this many bytes
+      aren't held in memory whole but produced in pieces as 'start_string',
+      'string_chunk' (with unicode pieces) and 'end_string' events
+    - string_sink: with max_string_size, a callable returning a writable
+      file-like object for every long string instead; the string is written
+      into it in utf-8 and the object becomes the value of the string event
+    '''
+    if stats is not None:
+        events = basic_parse(
+            stats.file(f), buf_size=buf_size, select=select, number=number,
+            intern_keys=intern_keys, multiple_values=multiple_values,
+            decompress_in_thread=decompress_in_thread,
+            max_string_size=max_string_size, string_sink=string_sink,
+        )
+        for event in stats.basic_events(events):
             yield event
-        symbol = f.next()
-        if symbol == '}':
-            break
-        if symbol != ',':
-            raise common.JSONError('Unexpected symbol')
-    yield ('end_map', None)
+        return
+    number = common.number_converter(number)
+    f, close = streams.open_input(f, decompress_in_thread, buf_size)
+    mapping = common.map_file(f) if isinstance(f, basestring) else None
+    try:
+        if max_string_size is None:
+            f = iter(Reader(f if mapping is None else mapping, buf_size))
+        else:
+            f = iter(StreamingReader(f if mapping is None else mapping, buf_size, max_string_size))
+        if select is not None:
+            state = common.compile_prefixes(select).root
+        if intern_keys:
+            intern = common.key_interner(intern_keys)
+        for symbol in (value_starts(f) if multiple_values else [f.next()]):
+            if select is None:
+                events = parse_value(f, symbol, number)
+            else:
+                events = parse_selected(f, symbol, state, number)
+            if max_string_size is not None:
+                events = long_strings(events, f, string_sink)
+            if intern_keys:
+                for event, value in events:
+                    if event == 'map_key':
+                        value = intern(value)
+                    yield event, value
+            else:
+                for value in events:
+                    yield value
+        if not multiple_values:
+            try:
+                f.next()
+            except common.IncompleteJSONError:
+                pass
+            else:
+                raise common.JSONError('Additional data')
+    finally:
+        if mapping:
+            mapping.close()
+        if close is not None:
+            close()
+
+def basic_parse_batches(f, batch_size=BATCH_SIZE, **kwargs):
+    '''
+    Iterator yielding lists of up to `batch_size` events, for the same
+    interface as yajl's basic_parse_batches. This parser produces events one
+    at a time anyway, so batches only group them. Keyword arguments are those
+    of basic_parse.
+    '''
+    events = basic_parse(f, **kwargs)
+    while True:
+        batch = list(islice(events, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def spans(f, state):
+    '''
+    Skips values matched by a MatchState in the input of a Reader, yielding
+    triples of (keys, start, end) where start and end are offsets of a value
+    in the input and keys is the list of components of the path leading to
+    it: map keys as they are in the input, with escapes left undecoded, and
+    None for array items. The list is reused, so it should be copied if it's
+    kept.
+    '''
+    keys = []
+    for event, value in parse_selected(f, f.next(), state, None, value_span):
+        if event == 'span':
+            start, end = value
+            yield keys, start, end
+        elif event == 'map_key':
+            keys[-1] = value
+        elif event == 'start_map' or event == 'start_array':
+            keys.append(None)
+        else:
+            keys.pop()
+
+def locate(file, prefix, buf_size=BUFSIZE):
+    '''
+    Finds values under a prefix (which may be a pattern) without parsing them
+    and yields triples of their (path, start, end) where start and end are
+    offsets in the input. Only the structure leading to the values is
+    checked, while the values themselves are skipped by tracking brackets and
+    strings, so they aren't validated. Values nested in other matched values
+    aren't reported separately.
+    '''
+    state = common.compile_prefixes(prefix).root
+    mapping = common.map_file(file) if isinstance(file, basestring) else None
+    try:
+        f = iter(Reader(file if mapping is None else mapping, buf_size))
+        for keys, start, end in spans(f, state):
+            path = '.'.join(['item' if key is None else key for key in keys])
+            yield path, start, end
+    finally:
+        if mapping:
+            mapping.close()
 
-def basic_parse(f):
-    f = iter(Reader(f))
-    for value in parse_value(f):
-        yield value
+def lexems(data, final):
+    '''
+    Splits a piece of input into lexems returning a list of the complete ones
+    and the position where the rest starts. Unless the input is final, a
+    literal or a number reaching the end of it may continue further.
+    '''
+    reader = iter(Reader(data))
+    result = []
+    end = 0
     try:
-        f.next()
+        while True:
+            symbol = reader.next()
+            pos = reader.offset + reader.pos
+            if pos == len(data) and not final and ATOMSTART.match(symbol):
+                break
+            result.append(symbol)
+            end = pos
     except common.IncompleteJSONError:
         pass
+    return result, end
+
+class Symbols(deque):
+    '''
+    Lexems of input pushed to basic_parse_coro read by parse_value.
+    '''
+    def next(self):
+        try:
+            return self.popleft()
+        except IndexError:
+            raise common.IncompleteJSONError()
+
+@utils.coroutine
+def basic_parse_coro(target, number=Decimal, intern_keys=0, multiple_values=False):
+    '''
+    A push counterpart of basic_parse: a coroutine accepting chunks of input
+    with .send() and sending events parsed from each chunk to `target` right
+    away. An empty chunk marks the end of input. Parameters are the same as
+    of basic_parse.
+    '''
+    number = common.number_converter(number)
+    if intern_keys:
+        intern = common.key_interner(intern_keys)
+    symbols = Symbols()
+    pieces = []
+    backslashes = None # trailing ones of the unfinished string pieces start with
+    events = None # events of the value being parsed
+    parsed = False
+    while True:
+        data = yield
+        final = not data
+        pieces.append(data)
+        if backslashes is not None and not final:
+            end, backslashes = closing_quote(data, 0, backslashes)
+            if end == -1:
+                # the inside of a long string, nothing to split until it ends
+                continue
+        data = ''.join(pieces)
+        found, end = lexems(data, final)
+        symbols.extend(found)
+        rest = data[end:]
+        pieces = [rest]
+        backslashes = None
+        string = rest.lstrip()
+        if string.startswith('"'):
+            backslashes = closing_quote(string, 1)[1]
+        # parse_value reads at most two symbols before producing an event,
+        # so it's resumed only while it can't run out of them mid-input
+        while final or len(symbols) > 1:
+            if events is None:
+                if not symbols:
+                    break
+                if parsed and not multiple_values:
+                    raise common.JSONError('Additional data')
+                events = parse_value(symbols, symbols.next(), number)
+                parsed = True
+            try:
+                event, value = events.next()
+            except StopIteration:
+                events = None
+                continue
+            if intern_keys and event == 'map_key':
+                value = intern(value)
+            target.send((event, value))
+        if final:
+            if not parsed:
+                raise common.IncompleteJSONError()
+            break
+    while True:
+        if (yield):
+            raise common.JSONError('Data after the end of input')
+
+def parse(file, stats=None, **kwargs):
+    events = common.parse(basic_parse(file, stats=stats, **kwargs))
+    if stats is not None:
+        events = stats.layer(events, 'parse')
+    return events
+
+def parse_batches(file, **kwargs):
+    return common.parse_batches(basic_parse_batches(file, **kwargs))
+
+def check_strings(kwargs):
+    if kwargs.get('max_string_size') is not None and kwargs.get('string_sink') is None:
+        raise ValueError('Objects with long strings can only be built with a string_sink')
+
+def items(file, prefix, map_type=None, array_type=None, fields=None, stats=None, **kwargs):
+    check_strings(kwargs)
+    matcher = common.compile_prefixes(prefix)
+    if fields is None:
+        select = matcher
     else:
-        raise common.JSONError('Additional data')
+        select = common.projection(matcher, fields)
+    events = basic_parse(file, select=select, stats=stats, **kwargs)
+    found = common.items(events, matcher, map_type, array_type)
+    if stats is not None:
+        found = stats.layer(found, 'items')
+    return found
+
+def multi_items(file, prefixes, map_type=None, array_type=None, stats=None, **kwargs):
+    check_strings(kwargs)
+    matcher = common.compile_prefixes(prefixes)
+    events = basic_parse(file, select=matcher, stats=stats, **kwargs)
+    found = common.multi_items(events, matcher, map_type, array_type)
+    if stats is not None:
+        found = stats.layer(found, 'items')
+    return found
+
+def route_items(file, consumers, map_type=None, array_type=None, **kwargs):
+    check_strings(kwargs)
+    matcher = common.compile_prefixes(consumers)
+    events = basic_parse(file, select=matcher, **kwargs)
+    return common.route_items(events, consumers, map_type, array_type)
 
-def parse(file):
-    return common.parse(basic_parse(file))
+def parse_coro(target, **kwargs):
+    return basic_parse_coro(utils.parse_coro(target), **kwargs)
 
-def items(file, prefix):
-    return common.items(basic_parse(file), prefix)
+def items_coro(target, prefix, map_type=None, array_type=None, **kwargs):
+    return basic_parse_coro(utils.items_coro(target, prefix, map_type, array_type), **kwargs)
@@ -1,9 +1,16 @@
 from ctypes import Structure, c_uint, c_ubyte, c_int, c_long, c_double, \
                    c_void_p, c_char_p, CFUNCTYPE, POINTER, byref, string_at, cast , \
-                   cdll, util, c_char
+                   cdll, util, c_char, py_object
+import ctypes
 from decimal import Decimal
+from itertools import chain
+import mmap
 
-from ijson import common
+from ijson import common, streams, utils
+
+
+# ctypes of Python 2.6 has no c_ssize_t, c_long has its size on most platforms
+c_ssize_t = getattr(ctypes, 'c_ssize_t', c_long)
 
 
 so_name = util.find_library('yajl')
@@ -24,6 +31,7 @@ yajl.yajl_alloc.restype = POINTER(c_char)
 yajl.yajl_gen_alloc.restype = POINTER(c_char)
 yajl.yajl_gen_alloc2.restype = POINTER(c_char)
 yajl.yajl_get_error.restype = POINTER(c_char)
+yajl.yajl_get_bytes_consumed.restype = c_uint
 
 C_EMPTY = CFUNCTYPE(c_int, c_void_p)
 C_INT = CFUNCTYPE(c_int, c_void_p, c_int)
@@ -32,16 +40,6 @@ C_DOUBLE = CFUNCTYPE(c_int, c_void_p, c_double)
 C_STR = CFUNCTYPE(c_int, c_void_p, POINTER(c_ubyte), c_uint)
 
 
-def number(value):
-    '''
-    Helper function casting a string that represents any Javascript number
-    into appropriate Python value: either int or Decimal.
-    '''
-    try:
-        return int(value)
-    except ValueError:
-        return Decimal(value)
-
 _callback_data = [
     # Mapping of JSON parser events to callback C types and value converters.
     # Used to define the Callbacks structure and actual callback functions
@@ -52,7 +50,7 @@ _callback_data = [
     # takes precedence if defined
     ('integer', C_LONG, lambda v, l: int(string_at(v, l))),
     ('double', C_DOUBLE, lambda v, l: float(string_at(v, l))),
-    ('number', C_STR, lambda v, l: number(string_at(v, l))),
+    ('number', C_STR, lambda v, l: common.number(string_at(v, l))),
     ('string', C_STR, lambda v, l: string_at(v, l).decode('utf-8')),
     ('start_map', C_EMPTY, lambda: None),
     ('map_key', C_STR, lambda v, l: string_at(v, l)),
@@ -70,13 +68,225 @@ class Config(Structure):
         ("checkUTF8", c_uint)
     ]
 
+class Selection(object):
+    '''
+    Follows callbacks from yajl advancing a PrefixMatcher along the document
+    and records only events for matched values and for the containers
+    leading to them. Callbacks for other values only update nesting depth and
+    don't convert their arguments into Python values.
+    '''
+    def __init__(self, matcher, events):
+        self.events = events
+        self.state = matcher.root
+        self.containers = []
+        self.skip = 0   # depth inside a skipped container
+        self.inside = 0 # depth inside a matched container
+
+    def scalar(self, event, func, args):
+        if self.inside or (not self.skip and self.state.scalars):
+            self.events.append((event, func(*args)))
+        return 1
+
+    def start(self, event):
+        if self.skip:
+            self.skip += 1
+        elif self.inside:
+            self.inside += 1
+            self.events.append((event, None))
+        elif self.state.matches:
+            self.inside = 1
+            self.events.append((event, None))
+        elif self.state.alive:
+            self.events.append((event, None))
+            self.containers.append(self.state)
+            if event == 'start_array':
+                self.state = self.state.child('item')
+        else:
+            self.skip = 1
+        return 1
+
+    def end(self, event):
+        if self.skip:
+            self.skip -= 1
+        elif self.inside:
+            self.inside -= 1
+            self.events.append((event, None))
+        else:
+            self.state = self.containers.pop()
+            self.events.append((event, None))
+        return 1
+
+    def map_key(self, func, args):
+        if self.skip:
+            return 1
+        key = func(*args)
+        if self.inside:
+            self.events.append(('map_key', key))
+            return 1
+        self.state = self.containers[-1].child(key)
+        if self.state.alive:
+            self.events.append(('map_key', key))
+        return 1
+
+def mapping_address(mapping):
+    '''
+    Returns the address of memory behind an mmap object, or None where the
+    buffer interface isn't accessible through ctypes (e.g. on PyPy).
+    '''
+    try:
+        as_read_buffer = ctypes.pythonapi.PyObject_AsReadBuffer
+    except AttributeError:
+        return None
+    as_read_buffer.argtypes = [py_object, POINTER(c_void_p), POINTER(c_ssize_t)]
+    address = c_void_p()
+    length = c_ssize_t()
+    if as_read_buffer(mapping, byref(address), byref(length)) != 0:
+        return None
+    return address.value
+
+def file_chunks(f, buf_size):
+    while True:
+        buffer = f.read(buf_size)
+        yield buffer, len(buffer)
+
+def mapping_chunks(mapping, buf_size):
+    '''
+    Yields pointers into a memory-mapped file so that yajl reads it in place.
+    Falls back to slices of the mapping if its address isn't available.
+    '''
+    size = len(mapping)
+    address = mapping_address(mapping) if size else None
+    for offset in xrange(0, size, buf_size):
+        length = min(buf_size, size - offset)
+        if address is None:
+            yield mapping[offset:offset + length], length
+        else:
+            yield c_void_p(address + offset), length
+    while True:
+        yield '', 0
+
 YAJL_OK = 0
 YAJL_CANCELLED = 1
 YAJL_INSUFFICIENT_DATA = 2
 YAJL_ERROR = 3
 
 
-def basic_parse(f, allow_comments=False, check_utf8=False, buf_size=64 * 1024):
+def buffer_address(buffer):
+    if isinstance(buffer, c_void_p):
+        return buffer.value
+    return cast(c_char_p(buffer), c_void_p).value
+
+WHITESPACE = ' \t\n\r'
+
+def count_whitespace(address, length):
+    '''
+    Counts whitespace bytes at the beginning of a buffer looking at it through
+    small windows, so that long data after the whitespace isn't copied.
+    '''
+    count = 0
+    while count < length:
+        window = string_at(address + count, min(256, length - count))
+        rest = len(window.lstrip(WHITESPACE))
+        count += len(window) - rest
+        if rest:
+            break
+    return count
+
+class Parser(object):
+    '''
+    A yajl parser handle appending events to a list as chunks of input are
+    fed to it. Parameters are those of basic_parse. In multiple values mode
+    a new handle is started for every value, since yajl 1 stops after a
+    complete one.
+    '''
+    def __init__(self, events, allow_comments=False, check_utf8=False,
+                 select=None, number=Decimal, intern_keys=0,
+                 multiple_values=False):
+        # numbers always come as text, so integers of any size are exact
+        convert = common.number_converter(number)
+        overrides = {'number': lambda v, l: convert(string_at(v, l))}
+        if intern_keys:
+            intern = common.key_interner(intern_keys)
+            overrides = dict(overrides, map_key=lambda v, l: intern(string_at(v, l)))
+
+        if select is None:
+            def callback(event, func_type, func):
+                def c_callback(context, *args):
+                    events.append((event, func(*args)))
+                    return 1
+                return func_type(c_callback)
+        else:
+            selection = Selection(common.compile_prefixes(select), events)
+            def callback(event, func_type, func):
+                if event == 'start_map' or event == 'start_array':
+                    c_callback = lambda context: selection.start(event)
+                elif event == 'end_map' or event == 'end_array':
+                    c_callback = lambda context: selection.end(event)
+                elif event == 'map_key':
+                    c_callback = lambda context, *args: selection.map_key(func, args)
+                else:
+                    c_callback = lambda context, *args: selection.scalar(event, func, args)
+                return func_type(c_callback)
+
+        self.callbacks = Callbacks(*[
+            callback(name, func_type, overrides.get(name, func))
+            for name, func_type, func in _callback_data
+        ])
+        self.config = Config(allow_comments, check_utf8)
+        self.multiple_values = multiple_values
+        self.handle = None
+        if not multiple_values:
+            self.alloc()
+
+    def alloc(self):
+        self.handle = yajl.yajl_alloc(byref(self.callbacks), byref(self.config), None, None)
+
+    def free(self):
+        if self.handle is not None:
+            yajl.yajl_free(self.handle)
+            self.handle = None
+
+    def feed(self, buffer, length):
+        '''
+        Parses `length` bytes of input from a string or a pointer, with an
+        empty chunk marking the end of input. Raises JSONError for invalid
+        input and returns False if input ended in the middle of a value.
+        '''
+        offset = 0
+        while True:
+            if self.handle is None:
+                # between values in multiple values mode, the next one
+                # gets a new handle once it actually starts
+                if offset < length:
+                    offset += count_whitespace(buffer_address(buffer) + offset, length - offset)
+                if offset == length:
+                    return True
+                self.alloc()
+            if offset:
+                piece = c_void_p(buffer_address(buffer) + offset)
+            else:
+                piece = buffer
+            size = length - offset
+            if size:
+                result = yajl.yajl_parse(self.handle, piece, size)
+            else:
+                result = yajl.yajl_parse_complete(self.handle)
+            if result == YAJL_ERROR:
+                perror = yajl.yajl_get_error(self.handle, 1, piece, size)
+                error = cast(perror, c_char_p).value
+                yajl.yajl_free_error(self.handle, perror)
+                raise common.JSONError(error)
+            if result != YAJL_OK or not self.multiple_values:
+                return result != YAJL_INSUFFICIENT_DATA
+            if not size:
+                return True
+            # yajl returns ok only after a complete value
+            offset += yajl.yajl_get_bytes_consumed(self.handle)
+            self.free()
+
+def basic_parse(f, allow_comments=False, check_utf8=False, buf_size=64 * 1024,
+                select=None, number=Decimal, intern_keys=0, multiple_values=False,
+                stats=None, decompress_in_thread=False):
     '''
     An iterator returning events from a JSON being parsed. This basic parser
     doesn't maintain any context and just returns parser events from an
@@ -84,17 +294,36 @@ def basic_parse(f, allow_comments=False, check_utf8=False, buf_size=64 * 1024):
 
     Parameters:
 
-    - f: a readable file-like object with JSON input
+    - f: a readable file-like object with JSON input, a path to a file or
+      an mmap object; files given by path are memory-mapped and passed to
+      yajl without copying
     - allow_comments: tells parser to allow comments in JSON input
     - check_utf8: if True, parser will cause an error if input is invalid utf-8
     - buf_size: a size of an input buffer
+    - select: a prefix, a collection of prefixes or a PrefixMatcher; when
+      given, only events for values under them and for the containers
+      leading to them are produced, callbacks for everything else skip
+      converting values. Prefixes may be patterns (see common.PrefixMatcher).
+    - number: how to represent numbers with a fraction or an exponent:
+      Decimal (default) or float, or common.RawNumber to keep the text of
+      every number and convert it only when it's read
+    - intern_keys: if non-zero, up to this many distinct map keys are cached
+      so that equal keys throughout the document share one string object
+    - multiple_values: if True, input may contain any number of values
+      separated by whitespace (e.g. JSON lines), and events of all of them
+      are produced one after another. yajl 1 stops after a complete value,
+      so a new parser handle is started for every value.
+    - stats: a common.Stats instance to collect statistics of parsing into
+    - decompress_in_thread: input compressed with gzip, bz2 or xz is
+      recognized and decompressed (see streams.open_input), in a background
+      thread if this is True
 
     Events returned from parser are pairs of (event type, value) and can be as
     follows:
 
         ('null', None)
         ('boolean', <True or False>)
-        ('number', <int or Decimal>)
+        ('number', <int, Decimal, float or RawNumber>)
         ('string', <unicode>)
         ('map_key', <str>)
         ('start_map', None)
@@ -102,42 +331,139 @@ def basic_parse(f, allow_comments=False, check_utf8=False, buf_size=64 * 1024):
         ('start_array', None)
         ('end_array', None)
     '''
-    events = []
+    if stats is not None:
+        events = basic_parse(
+            stats.file(f), allow_comments=allow_comments, check_utf8=check_utf8,
+            buf_size=buf_size, select=select, number=number,
+            intern_keys=intern_keys, multiple_values=multiple_values,
+            decompress_in_thread=decompress_in_thread,
+        )
+        for event in stats.basic_events(events):
+            yield event
+        return
+    for events in basic_parse_batches(
+        f, allow_comments, check_utf8, buf_size, select, number, intern_keys,
+        multiple_values, decompress_in_thread,
+    ):
+        for event in events:
+            yield event
 
-    def callback(event, func_type, func):
-        def c_callback(context, *args):
-            events.append((event, func(*args)))
-            return 1
-        return func_type(c_callback)
-
-    callbacks = Callbacks(*[callback(*data) for data in _callback_data])
-    config = Config(allow_comments, check_utf8)
-    handle = yajl.yajl_alloc(byref(callbacks), byref(config), None, None)
+def basic_parse_batches(f, allow_comments=False, check_utf8=False, buf_size=64 * 1024,
+                        select=None, number=Decimal, intern_keys=0,
+                        multiple_values=False, decompress_in_thread=False):
+    '''
+    Iterator yielding lists of events parsed from every chunk of input,
+    which spares consumers handling events in bulk the cost of resuming
+    an iterator for every event. Parameters are the same as of basic_parse.
+    '''
+    events = []
+    parser = Parser(
+        events, allow_comments, check_utf8, select, number, intern_keys,
+        multiple_values,
+    )
+    f, close = streams.open_input(f, decompress_in_thread, buf_size)
+    mapping = common.map_file(f) if isinstance(f, basestring) else None
+    if mapping is not None:
+        chunks = mapping_chunks(mapping, buf_size)
+    elif isinstance(f, mmap.mmap):
+        chunks = mapping_chunks(f, buf_size)
+    else:
+        chunks = file_chunks(f, buf_size)
     try:
-        while True:
-            buffer = f.read(buf_size)
-            if buffer:
-                result = yajl.yajl_parse(handle, buffer, len(buffer))
-            else:
-                result = yajl.yajl_parse_complete(handle)
-            if result == YAJL_ERROR:
-                perror = yajl.yajl_get_error(handle, 1, buffer, len(buffer))
-                error = cast(perror, c_char_p).value
-                yajl.yajl_free_error(handle, perror)
-                raise common.JSONError(error)
-            if not buffer and not events:
-                if result == YAJL_INSUFFICIENT_DATA:
+        for buffer, length in chunks:
+            complete = parser.feed(buffer, length)
+            if events:
+                yield events[:]
+                del events[:]
+            if not length:
+                if not complete:
                     raise common.IncompleteJSONError()
                 break
+    finally:
+        parser.free()
+        if mapping:
+            mapping.close()
+        if close is not None:
+            close()
 
+@utils.coroutine
+def basic_parse_coro(target, allow_comments=False, check_utf8=False, select=None,
+                     number=Decimal, intern_keys=0, multiple_values=False):
+    '''
+    A push counterpart of basic_parse: a coroutine accepting chunks of input
+    with .send() and sending events parsed from each chunk to `target` right
+    away. An empty chunk marks the end of input. Parameters are the same as
+    of basic_parse.
+    '''
+    events = []
+    parser = Parser(
+        events, allow_comments, check_utf8, select, number, intern_keys,
+        multiple_values,
+    )
+    try:
+        while True:
+            data = yield
+            complete = parser.feed(data, len(data))
             for event in events:
-                yield event
-            events = []
+                target.send(event)
+            del events[:]
+            if not data:
+                if not complete:
+                    raise common.IncompleteJSONError()
+                break
     finally:
-        yajl.yajl_free(handle)
+        parser.free()
+    while True:
+        if (yield):
+            raise common.JSONError('Data after the end of input')
+
+def parse(file, stats=None, **kwargs):
+    events = common.parse(basic_parse(file, stats=stats, **kwargs))
+    if stats is not None:
+        events = stats.layer(events, 'parse')
+    return events
+
+def parse_batches(file, **kwargs):
+    return common.parse_batches(basic_parse_batches(file, **kwargs))
+
+def selected_events(file, select, stats, **kwargs):
+    '''
+    Selected basic events for building objects. Without statistics they're
+    taken from batches, so only iteration over lists happens per event.
+    '''
+    if stats is not None:
+        return basic_parse(file, select=select, stats=stats, **kwargs)
+    return chain.from_iterable(basic_parse_batches(file, select=select, **kwargs))
+
+def items(file, prefix, map_type=None, array_type=None, fields=None, stats=None, **kwargs):
+    matcher = common.compile_prefixes(prefix)
+    if fields is None:
+        select = matcher
+    else:
+        select = common.projection(matcher, fields)
+    events = selected_events(file, select, stats, **kwargs)
+    found = common.items(events, matcher, map_type, array_type)
+    if stats is not None:
+        found = stats.layer(found, 'items')
+    return found
+
+def multi_items(file, prefixes, map_type=None, array_type=None, stats=None, **kwargs):
+    matcher = common.compile_prefixes(prefixes)
+    events = selected_events(file, matcher, stats, **kwargs)
+    found = common.multi_items(events, matcher, map_type, array_type)
+    if stats is not None:
+        found = stats.layer(found, 'items')
+    return found
+
+def route_items(file, consumers, map_type=None, array_type=None, **kwargs):
+    matcher = common.compile_prefixes(consumers)
+    events = selected_events(file, matcher, None, **kwargs)
+    return common.route_items(events, consumers, map_type, array_type)
 
-def parse(file, **kwargs):
-    return common.parse(basic_parse(file, **kwargs))
+def parse_coro(target, **kwargs):
+    return basic_parse_coro(utils.parse_coro(target), **kwargs)
 
-def items(file, prefix):
-    return common.items(basic_parse(file), prefix)
+def items_coro(target, prefix, map_type=None, array_type=None, **kwargs):
+    matcher = common.compile_prefixes(prefix)
+    found = utils.items_coro(target, matcher, map_type, array_type)
+    return basic_parse_coro(found, select=matcher, **kwargs)
@@ -0,0 +1,203 @@
+'''
+Checkpoints for resuming long parses of seekable files.
+
+`items` iterates over objects like backends' `items` but also provides a
+token describing the position right after the last returned object. If
+parsing fails the token can be saved and passed to `items` or `parse`
+later to continue from that position instead of the start of the file:
+
+    objects = checkpoint.items(f, 'docs.item')
+    for o in objects:
+        do_something_with(o)
+        save(objects.token)
+    ...
+    for o in checkpoint.items(f, 'docs.item', token=load()):
+        ...
+
+A token is a string with the offset in the file and the keys of containers
+enclosing the position, so it's valid only for the same file.
+'''
+from cStringIO import StringIO
+from itertools import izip
+import json
+import mmap
+import os
+
+from ijson import common
+from ijson.backends import python
+
+
+BATCH_SIZE = 64 * 1024
+
+
+def encode_token(offset, keys):
+    return json.dumps([offset, list(keys)])
+
+def decode_token(token):
+    offset, keys = json.loads(token)
+    return offset, [None if key is None else key.encode('utf-8') for key in keys]
+
+def prelude(keys):
+    '''
+    Returns JSON text opening containers with given keys (None for arrays)
+    so that a parser fed with it continues right after a value in the last
+    of them.
+    '''
+    pieces = []
+    for i, key in enumerate(keys):
+        if key is None:
+            pieces.append('[')
+        else:
+            pieces.append('{')
+            if i < len(keys) - 1:
+                pieces.append('"%s":' % key)
+    return ''.join(pieces)
+
+def synthetic_events(keys):
+    '''
+    Counts events a parser produces for the prelude of given keys.
+    '''
+    return len(keys) + len([key for key in keys[:-1] if key is not None])
+
+class Resumed(object):
+    '''
+    A file-like object reading a prelude followed by a file from an offset
+    right after a value, with whitespace and a comma separating the value
+    from the next one dropped. `skipped` is the number of bytes dropped.
+    '''
+    def __init__(self, f, offset, prelude):
+        self.f = f
+        f.seek(offset)
+        self.skipped = 0
+        rest = ''
+        while True:
+            chunk = f.read(python.BUFSIZE)
+            if not chunk:
+                break
+            rest = chunk.lstrip()
+            self.skipped += len(chunk) - len(rest)
+            if rest:
+                if rest[0] == ',':
+                    rest = rest[1:]
+                    self.skipped += 1
+                break
+        self.pending = prelude + rest
+
+    def read(self, size):
+        if self.pending:
+            data = self.pending[:size]
+            self.pending = self.pending[size:]
+            return data
+        return self.f.read(size)
+
+def open_file(file):
+    '''
+    Returns a file object for a path or a file object, and whether it
+    should be closed after use.
+    '''
+    if isinstance(file, basestring):
+        return open(file, 'rb'), True
+    return file, False
+
+class Items(object):
+    '''
+    An iterator over objects under a prefix of a seekable file, whose
+    `token` is a checkpoint right after the last returned object (or the
+    one it was started from). Objects are found by a structural scan (see
+    `python.locate`) and parsed by a backend in batches of about
+    `batch_size` bytes. Objects nested in other matched objects aren't
+    returned separately.
+    '''
+    def __init__(self, file, prefix, token=None, backend=python,
+                 batch_size=BATCH_SIZE, **kwargs):
+        self.file = file
+        self.matcher = common.compile_prefixes(prefix)
+        self.token = token
+        self.backend = backend
+        self.batch_size = batch_size
+        self.kwargs = kwargs
+        self.iterator = self.iterate()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.iterator.next()
+
+    def batches(self, mapping):
+        '''
+        Yields lists of (start, end, keys) of found objects in the file.
+        '''
+        if self.token is None:
+            stream = mapping
+            shift = 0
+        else:
+            offset, keys = decode_token(self.token)
+            if not keys:
+                # the token is after the top-level value
+                return
+            text = prelude(keys)
+            stream = Resumed(mapping, offset, text)
+            # offsets in the stream are turned into offsets in the file
+            shift = offset + stream.skipped - len(text)
+        f = iter(python.Reader(stream))
+        batch = []
+        size = 0
+        for keys, start, end in python.spans(f, self.matcher.root):
+            batch.append((start + shift, end + shift, tuple(keys)))
+            size += end - start
+            if size >= self.batch_size:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    def iterate(self):
+        f, close = open_file(self.file)
+        try:
+            if os.fstat(f.fileno()).st_size:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                mapping = ''
+            try:
+                for batch in self.batches(mapping):
+                    text = '[%s]' % ','.join([mapping[start:end] for start, end, keys in batch])
+                    values = self.backend.items(StringIO(text), 'item', **self.kwargs)
+                    for (start, end, keys), value in izip(batch, values):
+                        self.token = encode_token(end, keys)
+                        yield value
+            finally:
+                if mapping:
+                    mapping.close()
+        finally:
+            if close:
+                f.close()
+
+def items(file, prefix, token=None, backend=python, **kwargs):
+    '''
+    Iterates over objects under a prefix of a seekable file starting from a
+    token, if given, and keeping a token for the position after the last
+    returned object in the `token` attribute of the iterator. See Items.
+    '''
+    return Items(file, prefix, token, backend, **kwargs)
+
+def parse(file, token, backend=python, **kwargs):
+    '''
+    Resumes parsing a seekable file from a token produced by `items`,
+    yielding the events with prefixes that the backend's `parse` would
+    yield after the object the token was taken at.
+    '''
+    offset, keys = decode_token(token)
+    if not keys:
+        return
+    f, close = open_file(file)
+    try:
+        events = backend.parse(Resumed(f, offset, prelude(keys)), **kwargs)
+        for i in xrange(synthetic_events(keys)):
+            events.next()
+        for event in events:
+            yield event
+    finally:
+        if close:
+            f.close()
@@ -1,3 +1,12 @@
+from collections import deque
+from decimal import Decimal
+from itertools import islice
+import mmap
+import os
+import re
+from timeit import default_timer as timer
+
+
 class JSONError(Exception):
     pass
 
@@ -5,6 +14,463 @@ class IncompleteJSONError(JSONError):
     def __init__(self):
         super(IncompleteJSONError, self).__init__('Incomplete or empty JSON data')
 
+# Wildcard components of prefix patterns, "*" and "**" unless escaped
+ANY_KEY = object()
+ANY_PATH = object()
+WILDCARDS = {'*': ANY_KEY, '**': ANY_PATH}
+
+def split_pattern(pattern):
+    '''
+    Splits a prefix pattern into a tuple of components, with ANY_KEY and
+    ANY_PATH standing for "*" and "**". A backslash makes the next character
+    literal, so that "a\\.b" is a single component "a.b" and "\\*" matches a
+    key "*".
+    '''
+    if '\\' not in pattern:
+        return tuple(WILDCARDS.get(c, c) for c in pattern.split('.')) if pattern else ()
+    components = []
+    chars = []
+    escaped = False
+    pattern = iter(pattern)
+    for char in pattern:
+        if char == '\\':
+            chars.append(next(pattern, '\\'))
+            escaped = True
+        elif char == '.':
+            component = ''.join(chars)
+            components.append(component if escaped else WILDCARDS.get(component, component))
+            chars = []
+            escaped = False
+        else:
+            chars.append(char)
+    component = ''.join(chars)
+    components.append(component if escaped else WILDCARDS.get(component, component))
+    return tuple(components)
+
+class MatchState(object):
+    '''
+    A state of a compiled PrefixMatcher corresponding to a position in a
+    JSON document. `matches` is a tuple of patterns matching a value at this
+    position and `alive` tells if there may be matches at or below it, while
+    empty `keys` mean that nothing below it can match. `scalars` tells if a
+    value here is selected when it's not a container, which is where
+    patterns or scalar patterns match. Moving to a child value is done with
+    `child(key)`, where key is a map key or "item" for array items.
+    '''
+    def __init__(self, matcher, positions):
+        self.matcher = matcher
+        self.positions = positions
+        self.alive = bool(positions)
+        complete = sorted(set(
+            i for i, pos in positions if pos == len(matcher.patterns[i])
+        ))
+        self.matches = tuple(matcher.names[i] for i in complete if i < len(matcher.names))
+        self.scalars = bool(complete)
+        self.keys = frozenset(
+            matcher.patterns[i][pos] for i, pos in positions
+            if pos < len(matcher.patterns[i])
+        )
+        self.transitions = {}
+        self.other = None
+
+    def child(self, key):
+        state = self.transitions.get(key)
+        if state is not None:
+            return state
+        if key not in self.keys:
+            # all keys not mentioned in patterns lead to the same state
+            if self.other is None:
+                self.other = self.matcher.advance(self.positions, None)
+            return self.other
+        state = self.transitions[key] = self.matcher.advance(self.positions, key)
+        return state
+
+class PrefixMatcher(object):
+    '''
+    A set of prefix patterns compiled into a state machine that is advanced
+    along the structure of a document so that checking whether a value is
+    under one of the prefixes doesn't need a full path string.
+
+    Patterns are prefixes with dot-separated components where "*" matches any
+    single component and "**" matches any number of them, including none.
+    For example "earth.*.item" matches items of every continent and
+    "docs.item.meta.**" matches "meta" and everything inside it. Keys
+    containing dots or being "*" are written with backslashes, like
+    "a\\.b.\\*" (see split_pattern).
+
+    `scalar_patterns` match only values that aren't containers. They aren't
+    reported in `matches` and only make `scalars` of their states true.
+    '''
+    def __init__(self, patterns, scalar_patterns=()):
+        self.names = list(patterns)
+        self.patterns = [split_pattern(p) for p in self.names + list(scalar_patterns)]
+        self.states = {}
+        self.root = self.state(frozenset((i, 0) for i in range(len(self.patterns))))
+
+    def closure(self, positions):
+        result = set()
+        for i, pos in positions:
+            pattern = self.patterns[i]
+            result.add((i, pos))
+            while pos < len(pattern) and pattern[pos] is ANY_PATH:
+                pos += 1
+                result.add((i, pos))
+        return frozenset(result)
+
+    def state(self, positions):
+        positions = self.closure(positions)
+        state = self.states.get(positions)
+        if state is None:
+            state = self.states[positions] = MatchState(self, positions)
+        return state
+
+    def advance(self, positions, key):
+        result = []
+        for i, pos in positions:
+            pattern = self.patterns[i]
+            if pos < len(pattern):
+                component = pattern[pos]
+                if component is ANY_PATH:
+                    result.append((i, pos))
+                elif component is ANY_KEY or component == key:
+                    result.append((i, pos + 1))
+        return self.state(result)
+
+    def find(self, prefix):
+        '''
+        Returns the state for a prefix produced by `parse`. Keys in it may
+        contain dots, so keys mentioned by patterns are tried before
+        splitting the prefix at the next dot.
+        '''
+        state = self.root
+        while prefix:
+            key = None
+            for candidate in state.keys:
+                if candidate is ANY_KEY or candidate is ANY_PATH:
+                    continue
+                if (prefix == candidate or prefix.startswith(candidate + '.')) and \
+                        (key is None or len(candidate) > len(key)):
+                    key = candidate
+            if key is None:
+                key = prefix.split('.', 1)[0]
+            state = state.child(key)
+            prefix = prefix[len(key) + 1:]
+        return state
+
+def number(value):
+    '''
+    Helper function casting a string that represents any Javascript number
+    into appropriate Python value: either int or Decimal.
+    '''
+    if '.' in value or 'e' in value or 'E' in value:
+        return Decimal(value)
+    return int(value)
+
+def float_number(value):
+    '''
+    Like `number` but uses float for numbers with a fraction or an exponent.
+    '''
+    if '.' in value or 'e' in value or 'E' in value:
+        return float(value)
+    return int(value)
+
+class RawNumber(object):
+    '''
+    A number kept as its JSON text and converted only when it's read, either
+    with int(), long() or float() or through the `value` attribute which
+    holds int or Decimal as produced by default.
+    '''
+    __slots__ = ['text']
+
+    def __init__(self, text):
+        self.text = text
+
+    @property
+    def value(self):
+        return number(self.text)
+
+    def __int__(self):
+        return int(self.value)
+
+    def __long__(self):
+        return long(self.value)
+
+    def __float__(self):
+        return float(self.text)
+
+    def __eq__(self, other):
+        if isinstance(other, RawNumber):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'RawNumber(%r)' % self.text
+
+NUMBER = re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?$')
+
+def raw_number(value):
+    '''
+    Wraps number text in RawNumber, checking first that it's a valid JSON
+    number since it isn't converted right away.
+    '''
+    if NUMBER.match(value) is None:
+        raise ValueError('Invalid number: %r' % value)
+    return RawNumber(value)
+
+NUMBER_POLICIES = {
+    Decimal: number,
+    float: float_number,
+    RawNumber: raw_number,
+}
+
+def number_converter(policy):
+    '''
+    Returns a function converting number text according to a policy: Decimal
+    (the default) or float for numbers with a fraction or an exponent, or
+    RawNumber to defer conversion. Integers are int with the first two.
+    '''
+    try:
+        return NUMBER_POLICIES[policy]
+    except KeyError:
+        raise ValueError('Unknown number policy: %r' % (policy,))
+
+def key_interner(size):
+    '''
+    Returns a function mapping equal strings to the same string object, so
+    that map keys repeated across a document are stored once in objects built
+    from it. At most `size` distinct keys are kept, others are passed as is.
+    '''
+    cache = {}
+    def intern(key):
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        if len(cache) < size:
+            cache[key] = key
+        return key
+    return intern
+
+class StatsFile(object):
+    '''
+    A file-like object counting bytes read from a file and time spent on it.
+    '''
+    def __init__(self, f, stats):
+        self.f = f
+        self.stats = stats
+
+    def read(self, size):
+        start = timer()
+        data = self.f.read(size)
+        self.stats.times['read'] += timer() - start
+        self.stats.bytes += len(data)
+        return data
+
+class Stats(object):
+    '''
+    Statistics of parsing collected when an instance is passed as `stats` to
+    backends' basic_parse, parse, items or multi_items. Attributes:
+
+    - bytes: a number of bytes of input, all of it for mapped files
+    - events: a dict of numbers of events by their type
+    - depth, max_depth: current and maximum nesting of containers
+    - items: a number of objects yielded by items or multi_items
+    - times: cumulative seconds spent in layers, each including the ones
+      below it: "read" (reading a file), "basic_parse", "parse" and "items"
+
+    Everything is updated as parsing goes, so it can be exported while a
+    document is being parsed. See `breakdown` for time spent in each stage.
+
+    Without stats nothing is done at all. Counting makes basic_parse about
+    15% slower, and less so for layers above it. Timing layers means reading
+    the clock around every event, which makes parsing up to 1.5 times
+    slower, so only reads are timed unless `timing` is True.
+    '''
+    def __init__(self, timing=False):
+        self.timing = timing
+        self.bytes = 0
+        self.events = {}
+        self.depth = 0
+        self.max_depth = 0
+        self.items = 0
+        self.times = {'read': 0.0, 'basic_parse': 0.0, 'parse': 0.0, 'items': 0.0}
+
+    def breakdown(self):
+        '''
+        Returns a dict of seconds spent in stages excluding each other:
+        "read", "parse" (tokenizing input), "prefixes" (building prefixes in
+        `parse`) and "build" (building objects in `items`). Only "read" is
+        known without `timing`.
+        '''
+        times = self.times
+        result = {'read': times['read'], 'parse': 0.0, 'prefixes': 0.0, 'build': 0.0}
+        if times['basic_parse']:
+            result['parse'] = times['basic_parse'] - times['read']
+        if times['parse']:
+            result['prefixes'] = times['parse'] - times['basic_parse']
+        if times['items']:
+            result['build'] = times['items'] - times['basic_parse']
+        return result
+
+    def file(self, f):
+        '''
+        Wraps input of basic_parse so that reading it is accounted for.
+        Paths and mmap objects are returned as is with their whole size
+        counted.
+        '''
+        if isinstance(f, basestring):
+            self.bytes += os.path.getsize(f)
+            return f
+        if isinstance(f, mmap.mmap):
+            self.bytes += len(f)
+            return f
+        return StatsFile(f, self)
+
+    def basic_events(self, events):
+        '''
+        Passes basic events through counting them, and timing their source
+        if asked to.
+        '''
+        counts = self.events
+        if self.timing:
+            events = self.timed(events, 'basic_parse')
+        for item in events:
+            event = item[0]
+            if event in counts:
+                counts[event] += 1
+            else:
+                counts[event] = 1
+            if event == 'start_map' or event == 'start_array':
+                depth = self.depth = self.depth + 1
+                if depth > self.max_depth:
+                    self.max_depth = depth
+            elif event == 'end_map' or event == 'end_array':
+                self.depth -= 1
+            yield item
+
+    def layer(self, iterator, name):
+        '''
+        Passes values of the layer `name` through timing their source if
+        asked to, and counting them if it's "items".
+        '''
+        if self.timing:
+            iterator = self.timed(iterator, name)
+        if name != 'items':
+            return iterator
+        return self.counted(iterator)
+
+    def counted(self, iterator):
+        for value in iterator:
+            self.items += 1
+            yield value
+
+    def timed(self, iterator, name):
+        iterator = iter(iterator)
+        times = self.times
+        while True:
+            start = timer()
+            try:
+                value = iterator.next()
+            finally:
+                times[name] += timer() - start
+            yield value
+
+def map_file(path):
+    '''
+    Maps a file into memory for reading, so that backends can parse it
+    without copying it into strings chunk by chunk. Empty files can't be
+    mapped and are returned as empty strings.
+    '''
+    f = open(path, 'rb')
+    try:
+        if not os.fstat(f.fileno()).st_size:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+def compile_prefixes(select):
+    '''
+    Compiles a prefix or an iterable of prefixes into a PrefixMatcher. An
+    already compiled matcher is returned as is.
+    '''
+    if isinstance(select, PrefixMatcher):
+        return select
+    if isinstance(select, basestring):
+        select = [select]
+    return PrefixMatcher(select)
+
+def projection(prefixes, fields):
+    '''
+    Compiles patterns selecting only given fields of values under prefixes.
+    Fields are paths relative to those values, like "id" or "info.name", and
+    may be patterns too. Values under prefixes that aren't containers are
+    selected whole. The result is meant for the `select` parameter of
+    backends' basic_parse.
+    '''
+    if isinstance(prefixes, PrefixMatcher):
+        prefixes = prefixes.names
+    elif isinstance(prefixes, basestring):
+        prefixes = [prefixes]
+    if isinstance(fields, basestring):
+        fields = [fields]
+    return PrefixMatcher([
+        '.'.join(p for p in (prefix, field) if p)
+        for prefix in prefixes for field in fields
+    ], prefixes)
+
+def select(events, matcher):
+    '''
+    Filters basic events leaving only the ones for values matched by a
+    PrefixMatcher (scalar patterns included) and for the containers leading
+    to them, the same as what backends produce with the `select` parameter
+    of basic_parse.
+    '''
+    events = iter(events)
+    state = matcher.root
+    states = [] # states of enclosing containers
+    for event, value in events:
+        if event == 'map_key':
+            state = states[-1].child(value)
+            if state.alive:
+                yield event, value
+        elif event == 'end_map' or event == 'end_array':
+            state = states.pop()
+            yield event, value
+        elif state.matches or not state.alive:
+            matched = bool(state.matches)
+            if matched:
+                yield event, value
+            if event == 'start_map' or event == 'start_array':
+                depth = 1
+                for event, value in events:
+                    if matched:
+                        yield event, value
+                    if event == 'start_map' or event == 'start_array':
+                        depth += 1
+                    elif event == 'end_map' or event == 'end_array':
+                        depth -= 1
+                        if not depth:
+                            break
+        elif event == 'start_map':
+            yield event, value
+            states.append(state)
+        elif event == 'start_array':
+            yield event, value
+            states.append(state)
+            state = state.child('item')
+        elif state.scalars:
+            yield event, value
+        # other scalars leading nowhere are dropped
+
 def parse(events):
     '''
     An iterator returning events from a JSON being parsed. This iterator
@@ -45,35 +511,57 @@ def parse(events):
     - check_utf8: if True, parser will cause an error if input is invalid utf-8
     - buf_size: a size of an input buffer
     '''
-    path = []
+    # Prefixes of enclosing containers are kept on a stack so that each event
+    # reuses an already built string instead of joining the whole path anew.
+    # Only the top-level container has no dot before its children's
+    # components: one under an empty key also has the prefix "".
+    containers = []
+    prefix = ''
     for event, value in events:
         if event == 'map_key':
-            prefix = '.'.join(path[:-1])
-            path[-1] = value
+            container = containers[-1]
+            yield container, event, value
+            prefix = container + '.' + value if len(containers) > 1 else value
         elif event == 'start_map':
-            prefix = '.'.join(path)
-            path.append(None)
-        elif event == 'end_map':
-            path.pop()
-            prefix = '.'.join(path)
+            yield prefix, event, value
+            containers.append(prefix)
         elif event == 'start_array':
-            prefix = '.'.join(path)
-            path.append('item')
-        elif event == 'end_array':
-            path.pop()
-            prefix = '.'.join(path)
+            yield prefix, event, value
+            containers.append(prefix)
+            prefix = prefix + '.item' if len(containers) > 1 else 'item'
+        elif event == 'end_map' or event == 'end_array':
+            prefix = containers.pop()
+            yield prefix, event, value
         else: # any scalar value
-            prefix = '.'.join(path)
+            yield prefix, event, value
 
-        yield prefix, event, value
 
+def parse_batches(batches):
+    '''
+    Like `parse` but for lists of basic events, turning each of them into a
+    list of (prefix, event, value) triples. `parse` yields exactly one triple
+    per event, so it's fed from a queue holding the current batch.
+    '''
+    pending = deque()
+    triples = parse(iter(pending.popleft, None))
+    for events in batches:
+        pending.extend(events)
+        yield list(islice(triples, len(events)))
 
 class ObjectBuilder(object):
     '''
     Incrementally builds an object from JSON parser events. Events are passed
     into the `event` function that accepts two parameters: event type and
-    value. The object being built is available at any time from the `value`
-    attribute.
+    value. The object being built is available from the `value` attribute.
+
+    Maps and arrays are built as dicts and lists by default. Other types can
+    be given as `map_type`, a callable accepting a list of (key, value) pairs,
+    and `array_type`, a callable accepting a list of items, for example:
+
+        ObjectBuilder(map_type=OrderedDict, array_type=tuple)
+
+    Such containers are created once all their contents are known, so `value`
+    is only set when the top-level value is complete.
 
     Example:
 
@@ -88,47 +576,199 @@ class ObjectBuilder(object):
         print builder.value
 
     '''
-    def __init__(self):
-        def initial_set(value):
-            self.value = value
-        self.containers = [initial_set]
+    def __init__(self, map_type=None, array_type=None):
+        self.value = None
+        self.key = None
+        self.containers = []
+        if map_type is not None or array_type is not None:
+            self.map_type = dict if map_type is None else map_type
+            self.array_type = array_type
+            self.event = self.factory_event
 
     def event(self, event, value):
+        # Containers are put into their parents as soon as they start, so
+        # only the stack of open containers is needed to place values.
         if event == 'map_key':
             self.key = value
-        elif event == 'start_map':
-            map = {}
-            self.containers[-1](map)
-            def setter(value):
-                map[self.key] = value
-            self.containers.append(setter)
-        elif event == 'start_array':
-            array = []
-            self.containers[-1](array)
-            self.containers.append(array.append)
-        elif event == 'end_array' or event == 'end_map':
+            return
+        if event == 'end_map' or event == 'end_array':
             self.containers.pop()
+            return
+        if event == 'start_map':
+            container = {}
+        elif event == 'start_array':
+            container = []
         else:
-            self.containers[-1](value)
+            container = None
+        if container is not None:
+            value = container
+        containers = self.containers
+        if not containers:
+            self.value = value
+        else:
+            top = containers[-1]
+            if type(top) is list:
+                top.append(value)
+            else:
+                top[self.key] = value
+        if container is not None:
+            containers.append(container)
+
+    def factory_event(self, event, value):
+        # Contents are collected in lists, each one along with a flag telling
+        # if it's a map and the key under which it goes into its parent.
+        if event == 'map_key':
+            self.key = value
+            return
+        if event == 'start_map' or event == 'start_array':
+            self.containers.append(([], event == 'start_map', self.key))
+            return
+        if event == 'end_map':
+            contents, is_map, key = self.containers.pop()
+            value = self.map_type(contents)
+        elif event == 'end_array':
+            contents, is_map, key = self.containers.pop()
+            if self.array_type is not None:
+                value = self.array_type(contents)
+            else:
+                value = contents
+        else:
+            key = self.key
+        if not self.containers:
+            self.value = value
+        else:
+            contents, is_map, parent_key = self.containers[-1]
+            contents.append((key, value) if is_map else value)
 
-def items(events, prefix):
+class SendableList(list):
     '''
-    Iterates over a file objects and everything found under given prefix as
-    as native Python objects.
+    A list collecting everything sent to it, for use as the final target of
+    coroutines.
+
+        events = SendableList()
+        parser = basic_parse_coro(events)
+        parser.send(chunk)
+        for event in events:
+            ...
+        del events[:]
     '''
-    parser = iter(parse(events))
-    try:
-        while True:
-            current, event, value = parser.next()
-            if current == prefix:
-                builder = ObjectBuilder()
-                if event in ('start_map', 'start_array'):
-                    end_event = event.replace('start', 'end')
-                    while (current, event) != (prefix, end_event):
-                        builder.event(event, value)
-                        current, event, value = parser.next()
+    send = list.append
+
+def item_matcher(target, matcher, map_type=None, array_type=None):
+    '''
+    A generator accepting basic events with .send() and sending triples of
+    (path, matched patterns, object) for positions matched by a PrefixMatcher
+    to target. It has to be started with .next() (see utils.coroutine). When
+    matches are nested each of them is built by its own ObjectBuilder, and
+    inner objects are sent before the ones containing them. `map_type` and
+    `array_type` are passed to ObjectBuilder.
+    '''
+    state = matcher.root
+    states = [] # states of enclosing containers
+    keys = []   # path components leading to the current value
+    active = [] # (builder, depth, path, matches) of objects being built
+    while True:
+        event, value = yield
+        if event == 'map_key':
+            state = states[-1].child(value)
+            keys[-1] = value
+        elif event == 'end_map' or event == 'end_array':
+            state = states.pop()
+            keys.pop()
+        else:
+            if state.matches:
+                if active or state.keys:
+                    active.append((ObjectBuilder(map_type, array_type), len(states), '.'.join(keys), state.matches))
+                elif event == 'start_map' or event == 'start_array':
+                    # nothing can match inside, so the container is built
+                    # without following its structure
+                    builder = ObjectBuilder(map_type, array_type)
+                    build = builder.event
+                    build(event, value)
+                    depth = 1
+                    while depth:
+                        event, value = yield
+                        build(event, value)
+                        if event == 'start_map' or event == 'start_array':
+                            depth += 1
+                        elif event == 'end_map' or event == 'end_array':
+                            depth -= 1
+                    target.send(('.'.join(keys), state.matches, builder.value))
+                    continue
                 else:
-                    builder.event(event, value)
-                yield builder.value
-    except StopIteration:
-        pass
+                    target.send(('.'.join(keys), state.matches, value))
+                    continue
+            if event == 'start_map':
+                states.append(state)
+                keys.append(None)
+            elif event == 'start_array':
+                states.append(state)
+                keys.append('item')
+                state = state.child('item')
+        if active:
+            for match in active:
+                match[0].event(event, value)
+            builder, depth, path, matches = active[-1]
+            if depth == len(states):
+                active.pop()
+                target.send((path, matches, builder.value))
+
+def match_items(events, matcher, map_type=None, array_type=None):
+    '''
+    Builds objects found at positions matched by a PrefixMatcher yielding
+    triples of (path, matched patterns, object) by sending events to an
+    item_matcher. `map_type` and `array_type` are passed to ObjectBuilder.
+    '''
+    found = SendableList()
+    matches = item_matcher(found, matcher, map_type, array_type)
+    matches.next()
+    send = matches.send
+    for event in events:
+        send(event)
+        if found:
+            for match in found:
+                yield match
+            del found[:]
+
+def items(events, prefix, map_type=None, array_type=None, fields=None):
+    '''
+    Iterates over a file objects and everything found under given prefix as
+    as native Python objects. The prefix may be a pattern (see PrefixMatcher).
+    Maps and arrays are built with `map_type` and `array_type` when given
+    (see ObjectBuilder).
+
+    `fields` is a list of paths relative to the found objects (see
+    `projection`) limiting what's built of them: other members are left out
+    along with values under them, while containers leading to the fields are
+    kept even if they end up empty. Found values that aren't containers are
+    yielded as they are.
+    '''
+    matcher = compile_prefixes(prefix)
+    if fields is not None:
+        events = select(events, projection(matcher, fields))
+    for path, matches, value in match_items(events, matcher, map_type, array_type):
+        yield value
+
+def multi_items(events, prefixes, map_type=None, array_type=None):
+    '''
+    Iterates over everything found under any of given prefixes (which may be
+    patterns, see PrefixMatcher) in one pass, yielding pairs of (path,
+    object). Objects under nested prefixes are all yielded, the inner ones
+    first. `map_type` and `array_type` are used as in `items`.
+    '''
+    matcher = compile_prefixes(prefixes)
+    for path, matches, value in match_items(events, matcher, map_type, array_type):
+        yield path, value
+
+def route_items(events, consumers, map_type=None, array_type=None):
+    '''
+    Finds objects under several prefixes in one pass calling a consumer for
+    each of them. `consumers` is a dict mapping prefixes or patterns to
+    callables accepting an object. An object matching several patterns is
+    passed to each of their consumers. `map_type` and `array_type` are used
+    as in `items`.
+    '''
+    matcher = compile_prefixes(consumers)
+    for path, matches, value in match_items(events, matcher, map_type, array_type):
+        for pattern in matches:
+            consumers[pattern](value)
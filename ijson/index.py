@@ -0,0 +1,168 @@
+'''
+Indexes of positions of values in JSON documents for random access.
+
+An index is built once by scanning a document for values under a prefix
+(see `python.locate`) and can be saved next to the document. Reading a value
+through an index then costs only reading and parsing the value itself:
+
+    index = build('big.json', 'docs.item')
+    index.save('big.json.idx')
+    ...
+    index = load('big.json.idx')
+    f = open('big.json', 'rb')
+    doc = index.item(f, 4000000)
+'''
+from array import array
+from cStringIO import StringIO
+import json
+import os
+import sys
+
+from ijson.backends import python
+
+
+VERSION = 2
+# Numbers are kept as doubles: unsigned longs are 32-bit on Windows and on
+# 32-bit builds and Python 2 arrays have no 64-bit integers, while doubles
+# hold integers exactly up to 2 ** 53.
+TYPECODE = 'd'
+
+
+class Index(object):
+    '''
+    Positions of values found under a prefix in a document of a given size.
+    For every value its path and the offsets of its start and end are kept,
+    with paths stored once in `paths` and referred to by their number.
+    '''
+    def __init__(self, prefix, size, paths, path_ids, starts, ends):
+        self.prefix = prefix
+        self.size = size
+        self.paths = paths
+        self.path_ids = path_ids
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def path(self, n):
+        return self.paths[int(self.path_ids[n])]
+
+    def span(self, n):
+        return int(self.starts[n]), int(self.ends[n])
+
+    def check(self, f):
+        '''
+        Raises ValueError if a file doesn't have the size of the indexed
+        document, which means that the index is stale.
+        '''
+        if self.size is None:
+            return
+        try:
+            size = os.fstat(f.fileno()).st_size
+        except (AttributeError, IOError, OSError):
+            return
+        if size != self.size:
+            raise ValueError('Index doesn\'t match the document: %d bytes instead of %d' % (size, self.size))
+
+    def items(self, f, start=0, stop=None, backend=python, **kwargs):
+        '''
+        Reads and parses values number `start` to `stop` (exclusive) from a
+        seekable file with the indexed document. Values are read in one go
+        from the start of the first one to the end of the last one, so a
+        range shouldn't span large amounts of unindexed data. Keyword
+        arguments are passed to the backend's `items`.
+        '''
+        start, stop, step = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return iter([])
+        self.check(f)
+        offset = int(self.starts[start])
+        f.seek(offset)
+        data = f.read(int(self.ends[stop - 1]) - offset)
+        pieces = []
+        for n in xrange(start, stop):
+            begin, end = self.span(n)
+            pieces.append(data[begin - offset:end - offset])
+        return backend.items(StringIO('[%s]' % ','.join(pieces)), 'item', **kwargs)
+
+    def item(self, f, n, backend=python, **kwargs):
+        '''
+        Reads and parses value number `n` from a file with the indexed
+        document.
+        '''
+        if not -len(self) <= n < len(self):
+            raise IndexError('Index out of range')
+        n %= len(self)
+        return self.items(f, n, n + 1, backend, **kwargs).next()
+
+    def save(self, path):
+        '''
+        Saves the index into a file: a line of JSON with the prefix, the
+        size of the document and the paths, followed by the arrays of
+        numbers in binary.
+        '''
+        header = {
+            'version': VERSION,
+            'prefix': self.prefix,
+            'size': self.size,
+            'paths': self.paths,
+            'count': len(self),
+            'itemsize': self.starts.itemsize,
+            'byteorder': sys.byteorder,
+        }
+        f = open(path, 'wb')
+        try:
+            f.write(json.dumps(header) + '\n')
+            for numbers in (self.path_ids, self.starts, self.ends):
+                numbers.tofile(f)
+        finally:
+            f.close()
+
+def load(path):
+    '''
+    Loads an index saved with `Index.save`.
+    '''
+    f = open(path, 'rb')
+    try:
+        header = json.loads(f.readline())
+        if header['version'] != VERSION:
+            raise ValueError('Unsupported index version: %r' % header['version'])
+        if header['itemsize'] != array(TYPECODE).itemsize:
+            raise ValueError('Index was saved on a platform with different number size')
+        arrays = []
+        for i in range(3):
+            numbers = array(TYPECODE)
+            numbers.fromfile(f, header['count'])
+            if header['byteorder'] != sys.byteorder:
+                numbers.byteswap()
+            arrays.append(numbers)
+    finally:
+        f.close()
+    return Index(header['prefix'], header['size'], header['paths'], *arrays)
+
+def build(file, prefix, buf_size=python.BUFSIZE):
+    '''
+    Scans a document for values under a prefix (which may be a pattern) and
+    returns an Index of them. `file` is a path or a readable file-like
+    object, the document's size is recorded if it can be found out.
+    '''
+    paths = []
+    path_ids = {}
+    numbers = array(TYPECODE), array(TYPECODE), array(TYPECODE)
+    for path, start, end in python.locate(file, prefix, buf_size):
+        n = path_ids.get(path)
+        if n is None:
+            n = path_ids[path] = len(paths)
+            paths.append(path)
+        numbers[0].append(n)
+        numbers[1].append(start)
+        numbers[2].append(end)
+    if isinstance(file, basestring):
+        size = os.path.getsize(file)
+    else:
+        try:
+            size = os.fstat(file.fileno()).st_size
+        except (AttributeError, IOError, OSError):
+            size = None
+    return Index(prefix, size, paths, *numbers)
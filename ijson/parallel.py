@@ -0,0 +1,141 @@
+'''
+Parsing of large inputs in several processes.
+
+Input is split into independent pieces in the calling process and each piece
+is parsed by a backend in a `multiprocessing` pool, so objects built by
+workers must be picklable to be sent back.
+'''
+from cStringIO import StringIO
+from itertools import imap
+import multiprocessing
+
+from ijson import common
+from ijson.backends import backend_name, load_backend, python
+
+
+BATCH_SIZE = 1024 * 1024
+
+
+def line_batches(f, batch_size=BATCH_SIZE):
+    '''
+    Reads input in batches of whole lines about `batch_size` bytes each, so
+    that every batch can be parsed on its own when values don't span lines.
+    '''
+    pieces = []
+    while True:
+        data = f.read(batch_size)
+        if not data:
+            break
+        end = data.rfind('\n') + 1
+        if not end:
+            pieces.append(data)
+            continue
+        pieces.append(data[:end])
+        yield ''.join(pieces)
+        pieces = [data[end:]]
+    rest = ''.join(pieces)
+    if rest.strip():
+        yield rest
+
+def _parse_lines(task):
+    name, batch, prefix, kwargs = task
+    backend = load_backend(name)
+    return list(backend.items(StringIO(batch), prefix, multiple_values=True, **kwargs))
+
+def span_batches(spans, batch_size=BATCH_SIZE):
+    '''
+    Groups consecutive (path, start, end) spans found by `python.locate`
+    into lists of (start, end) covering about `batch_size` bytes each.
+    '''
+    batch = []
+    size = 0
+    for path, start, end in spans:
+        batch.append((start, end))
+        size += end - start
+        if size >= batch_size:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+def _parse_spans(task):
+    name, path, spans, kwargs = task
+    backend = load_backend(name)
+    mapping = common.map_file(path)
+    try:
+        batch = '[%s]' % ','.join([mapping[start:end] for start, end in spans])
+    finally:
+        if mapping:
+            mapping.close()
+    return list(backend.items(StringIO(batch), 'item', **kwargs))
+
+def _imap(func, tasks, processes, ordered):
+    '''
+    Maps tasks in a pool of processes, or in the current process if only one
+    is asked for.
+    '''
+    if processes == 1:
+        for result in imap(func, tasks):
+            yield result
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        if ordered:
+            results = pool.imap(func, tasks)
+        else:
+            results = pool.imap_unordered(func, tasks)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def line_items(f, prefix, backend='python', processes=None, ordered=True,
+               batch_size=BATCH_SIZE, **kwargs):
+    '''
+    Like backends' `items` but for JSON lines (one value per line) parsed in
+    a pool of processes. The prefix is matched against every value.
+
+    Parameters:
+
+    - f: a readable file-like object with JSON lines
+    - prefix: a prefix or a pattern, see `items`
+    - backend: a backend module or its name
+    - processes: a number of worker processes, all CPUs by default; with 1
+      everything is parsed in the current process
+    - ordered: if False, objects are yielded in the order batches are
+      finished rather than in the order of input
+    - batch_size: an approximate amount of input handed to a worker at once
+    - other keyword arguments are passed to the backend's `items`
+    '''
+    name = backend_name(backend)
+    tasks = (
+        (name, batch, prefix, kwargs)
+        for batch in line_batches(f, batch_size)
+    )
+    for result in _imap(_parse_lines, tasks, processes, ordered):
+        for value in result:
+            yield value
+
+def items(f, prefix, backend='python', processes=None, ordered=True,
+          batch_size=BATCH_SIZE, **kwargs):
+    '''
+    Like backends' `items` but parses found objects in a pool of processes.
+    The input is scanned for positions of the objects first (see
+    `python.locate`), and workers parse batches of them read directly from
+    the file, so it must be a path or a file object opened from one.
+
+    Parameters are the same as of `line_items`, other keyword arguments are
+    passed to the backend's `items` used on every batch.
+    '''
+    path = f if isinstance(f, basestring) else f.name
+    name = backend_name(backend)
+    tasks = (
+        (name, path, spans, kwargs)
+        for spans in span_batches(python.locate(path, prefix), batch_size)
+    )
+    for result in _imap(_parse_spans, tasks, processes, ordered):
+        for value in result:
+            yield value
@@ -0,0 +1,241 @@
+'''
+File-like wrappers preparing input for parsing.
+'''
+import bz2
+import mmap
+import Queue
+import threading
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+CHUNK_SIZE = 64 * 1024
+MAGIC = [
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bz2'),
+    ('\xfd7zXZ\x00', 'xz'),
+]
+MAGIC_SIZE = max(len(magic) for magic, name in MAGIC)
+
+
+class ReadAhead(object):
+    '''
+    A file-like object reading another one in a background thread, so that
+    waiting for input overlaps with parsing of what's already been read.
+    Reading a file releases the GIL, so this helps with slow sources like
+    network file systems and sockets.
+
+    Up to `depth` chunks of `chunk_size` bytes are read ahead. Errors of
+    reading are raised from `read` once the data read before them is
+    consumed. The thread stops at the end of input or when the object is
+    closed.
+
+        f = ReadAhead(urlopen('http://.../'))
+        try:
+            for o in items(f, 'earth.europe.item'):
+                ...
+        finally:
+            f.close()
+    '''
+    def __init__(self, f, chunk_size=CHUNK_SIZE, depth=4):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.queue = Queue.Queue(depth)
+        self.stopped = threading.Event()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.thread = threading.Thread(target=self.fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fill(self):
+        while True:
+            try:
+                chunk = self.f.read(self.chunk_size)
+            except Exception, e:
+                chunk = e
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put(chunk, timeout=0.1)
+                    break
+                except Queue.Full:
+                    pass
+            if self.stopped.is_set() or not chunk or isinstance(chunk, Exception):
+                return
+
+    def next_chunk(self):
+        chunk = self.queue.get()
+        if isinstance(chunk, Exception):
+            self.eof = True
+            raise chunk
+        if not chunk:
+            self.eof = True
+        return chunk
+
+    def read(self, size=-1):
+        '''
+        Returns up to `size` bytes, whole chunks as they are when they fit,
+        or everything left if size is negative.
+        '''
+        if self.pos == len(self.buffer):
+            if self.eof:
+                return ''
+            self.buffer = self.next_chunk()
+            self.pos = 0
+        if size < 0:
+            pieces = [self.buffer[self.pos:]]
+            while not self.eof:
+                pieces.append(self.next_chunk())
+            self.buffer = ''
+            self.pos = 0
+            return ''.join(pieces)
+        if self.pos == 0 and len(self.buffer) <= size:
+            data = self.buffer
+        else:
+            data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        '''
+        Stops the background thread. The wrapped file isn't closed.
+        '''
+        self.stopped.set()
+        self.thread.join()
+
+def compression(head):
+    '''
+    Returns the name of a compression format recognized by the first bytes
+    of input, or None.
+    '''
+    for magic, name in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+def decompressor(name):
+    if name == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if name == 'bz2':
+        return bz2.BZ2Decompressor()
+    if lzma is None:
+        raise ValueError('Decompressing xz input requires the lzma module')
+    return lzma.LZMADecompressor()
+
+class Peeked(object):
+    '''
+    A file-like object returning already read first bytes of a file before
+    the rest of it. After that reads go to the file directly.
+    '''
+    def __init__(self, f, head):
+        self.f = f
+        self.head = head
+
+    def read(self, size=-1):
+        head = self.head
+        if 0 <= size < len(head):
+            self.head = head[size:]
+            return head[:size]
+        self.read = self.f.read
+        return head + self.f.read(size - len(head) if size >= 0 else -1)
+
+class Decompressed(object):
+    '''
+    A file-like object decompressing a file compressed in a given format.
+    Reads of the compressed file are `chunk_size` bytes long and reads of
+    this object return as many bytes as asked for, except at the end, so
+    that parsers get full buffers regardless of the compression ratio.
+    Concatenated compressed streams, as produced by appending to a gzip
+    file, are decompressed one after another.
+    '''
+    def __init__(self, f, name, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.name = name
+        self.chunk_size = chunk_size
+        self.decompressor = decompressor(name)
+        self.buffer = ''
+        self.eof = False
+
+    def decompress(self, data):
+        pieces = []
+        while data:
+            try:
+                pieces.append(self.decompressor.decompress(data))
+            except EOFError:
+                # the previous stream ended exactly at the end of a chunk
+                self.decompressor = decompressor(self.name)
+                continue
+            data = getattr(self.decompressor, 'unused_data', '')
+            if data:
+                self.decompressor = decompressor(self.name)
+        return ''.join(pieces)
+
+    def read(self, size=-1):
+        pieces = [self.buffer]
+        length = len(self.buffer)
+        while (size < 0 or length < size) and not self.eof:
+            data = self.f.read(self.chunk_size)
+            if not data:
+                self.eof = True
+                if hasattr(self.decompressor, 'flush'):
+                    data = self.decompressor.flush()
+            else:
+                data = self.decompress(data)
+            pieces.append(data)
+            length += len(data)
+        data = ''.join(pieces)
+        if size < 0 or len(data) <= size:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+def open_input(f, thread=False, chunk_size=CHUNK_SIZE):
+    '''
+    Recognizes compressed input of basic_parse by its first bytes and
+    returns a pair of (input, close) where input is decompressed and close
+    is a function to call after parsing, or None. Uncompressed input is
+    returned as is, except that a file object gets wrapped to return its
+    first bytes again.
+
+    If `thread` is True decompression runs in a background thread (see
+    ReadAhead), both zlib and bz2 release the GIL while decompressing.
+    '''
+    close = None
+    if isinstance(f, basestring):
+        source = open(f, 'rb')
+        name = compression(source.read(MAGIC_SIZE))
+        if name is None:
+            source.close()
+            return f, None
+        source.seek(0)
+        close = source.close
+    elif isinstance(f, mmap.mmap):
+        name = compression(f[:MAGIC_SIZE])
+        if name is None:
+            return f, None
+        source = f
+        source.seek(0)
+    else:
+        head = f.read(MAGIC_SIZE)
+        source = Peeked(f, head)
+        name = compression(head)
+        if name is None:
+            return source, None
+    result = Decompressed(source, name, chunk_size)
+    if not thread:
+        return result, close
+    result = ReadAhead(result, chunk_size)
+    def close_all():
+        result.close()
+        if close is not None:
+            close()
+    return result, close_all
@@ -1,6 +1,9 @@
 # -*- coding:utf-8 -*-
+from collections import deque
 from functools import wraps
 
+from ijson import common
+
 
 def coroutine(func):
     '''
@@ -29,14 +32,20 @@ def foreach(coroutine_func):
     base, event, value = yield
     if event != 'start_array':
         raise Exception('foreach requires "start_array" as the first event, got %s' % repr((base, event, value)))
-    START_EVENTS = set(['start_map', 'start_array', 'null', 'boolean', 'number', 'string'])
-    itemprefix = base + '.item' if base else 'item'
+    # Items are told apart by nesting depth relative to the array: every
+    # event at depth 0 except the array's own end starts a new item.
+    depth = 0
     while True:
         prefix, event, value = yield
-        if prefix == itemprefix and event in START_EVENTS:
+        if not depth:
+            if event == 'end_array':
+                continue
             g = coroutine_func()
-        if (prefix, event) != (base, 'end_array'):
-            g.send((prefix, event, value))
+        if event == 'start_map' or event == 'start_array':
+            depth += 1
+        elif event == 'end_map' or event == 'end_array':
+            depth -= 1
+        g.send((prefix, event, value))
 
 @coroutine
 def dispatcher(targets):
@@ -45,11 +54,77 @@ def dispatcher(targets):
     prefixes.
 
     Accepts a list of tuples (base_prefix, coroutine). A coroutine then
-    receives all the events with prefixes starting with its base_prefix.
+    receives all the events with prefixes equal to its base_prefix or under
+    it, and when several base prefixes match an event it goes to the first
+    of them in the list. Base prefixes may be patterns (see
+    common.PrefixMatcher).
+
+    Base prefixes are compiled into a PrefixMatcher which is advanced along
+    the events, so routing an event costs the same however many targets
+    there are.
     '''
+    patterns = [base + '.**' if base else '**' for base, target in targets]
+    matcher = common.PrefixMatcher(patterns)
+    first = {}
+    for pattern, (base, target) in reversed(zip(patterns, targets)):
+        first[pattern] = target
+
+    state = None
+    states = [] # states of enclosing containers
     while True:
         prefix, event, value = yield
-        for base, target in targets:
-            if prefix.startswith(base):
-                target.send((prefix, event, value))
-                break
+        if event == 'map_key':
+            container = states[-1] if states else matcher.find(prefix)
+            matches = container.matches
+            state = container.child(value)
+        elif event == 'end_map' or event == 'end_array':
+            state = states.pop() if states else matcher.find(prefix)
+            matches = state.matches
+        else:
+            if not states:
+                state = matcher.find(prefix)
+            matches = state.matches
+            if event == 'start_map':
+                states.append(state)
+            elif event == 'start_array':
+                states.append(state)
+                state = state.child('item')
+        if matches:
+            first[matches[0]].send((prefix, event, value))
+
+SendableList = common.SendableList
+
+@coroutine
+def parse_coro(target):
+    '''
+    A coroutine counterpart of common.parse: accepts basic events (pairs of
+    event and value) and sends triples of (prefix, event, value) to target.
+    Each event gives one triple, so common.parse is fed from a queue.
+    '''
+    pending = deque()
+    triples = common.parse(iter(pending.popleft, None))
+    while True:
+        pending.append((yield))
+        target.send(triples.next())
+
+@coroutine
+def match_items_coro(target, matcher, map_type=None, array_type=None):
+    '''
+    A coroutine counterpart of common.match_items: accepts basic events and
+    sends triples of (path, matched patterns, object) to target.
+    '''
+    return common.item_matcher(target, matcher, map_type, array_type)
+
+@coroutine
+def item_values(target):
+    while True:
+        path, matches, value = yield
+        target.send(value)
+
+def items_coro(target, prefix, map_type=None, array_type=None):
+    '''
+    A coroutine counterpart of common.items: accepts basic events and sends
+    objects found under a prefix (which may be a pattern) to target.
+    '''
+    matcher = common.compile_prefixes(prefix)
+    return match_items_coro(item_values(target), matcher, map_type, array_type)
@@ -1,10 +1,21 @@
 # -*- coding:utf-8 -*-
+import bz2
+import gzip
 import unittest
 from cStringIO import StringIO
 from decimal import Decimal
+import mmap
+import os
+import sys
+import tempfile
 import threading
 
-from ijson import parse, basic_parse, JSONError, IncompleteJSONError, ObjectBuilder, items
+from ijson import parse, basic_parse, JSONError, IncompleteJSONError, ObjectBuilder, items, \
+                  multi_items, route_items
+from ijson import aio, checkpoint, common, index, parallel, streams, utils
+from ijson.common import PrefixMatcher, RawNumber, Stats
+from ijson.backends import python as pythonbackend
+from ijson.backends import yajl as yajlbackend
 
 
 JSON = r'''
@@ -31,6 +42,8 @@ JSON = r'''
   ]
 }
 '''
+MULTIPLE_JSON = '{"a": 1} [2]\n3 "x"{}  '
+LINES_JSON = '{"id": 1}\n{"id": 2, "tags": []}\n\n{"id": 3}\n'
 SCALAR_JSON = '0'
 EMPTY_JSON = ''
 INVALID_JSON = '{"key": "value",}'
@@ -43,6 +56,13 @@ STRINGS_JSON = r'''
     "str4": "\\\\"
 }
 '''
+SKIP_JSON = r'''
+{
+  "a": ["x\\\"]", {"b": "]}\"", "c": [1, {"d": 2}]}],
+  "e": {"f": [3, 4], "g": {}},
+  "h": 5
+}
+'''
 
 class Parse(unittest.TestCase):
     def test_basic_parse(self):
@@ -103,6 +123,80 @@ class Parse(unittest.TestCase):
         ]
         self.assertEqual(events, [1, 2])
 
+    def test_prefixes(self):
+        prefixes = [(prefix, event) for prefix, event, value in parse(StringIO(JSON))]
+        self.assertEqual(prefixes[:4], [
+            ('', 'start_map'),
+            ('', 'map_key'),
+            ('docs', 'start_array'),
+            ('docs.item', 'start_map'),
+        ])
+        self.assertEqual(prefixes[18:28], [
+            ('docs.item', 'end_map'),
+            ('docs.item', 'start_map'),
+            ('docs.item', 'map_key'),
+            ('docs.item.meta', 'start_array'),
+            ('docs.item.meta.item', 'start_array'),
+            ('docs.item.meta.item.item', 'number'),
+            ('docs.item.meta.item', 'end_array'),
+            ('docs.item.meta.item', 'start_array'),
+            ('docs.item.meta.item.item', 'number'),
+            ('docs.item.meta.item', 'end_array'),
+        ])
+        self.assertEqual(prefixes[-5:], [
+            ('docs.item', 'map_key'),
+            ('docs.item.meta', 'null'),
+            ('docs.item', 'end_map'),
+            ('docs', 'end_array'),
+            ('', 'end_map'),
+        ])
+
+    def test_empty_keys(self):
+        document = '{"": {"a": [1]}, "b": [{"": [2]}]}'
+        prefixes = [(prefix, event) for prefix, event, value in parse(StringIO(document))]
+        self.assertEqual(prefixes, [
+            ('', 'start_map'),
+            ('', 'map_key'),
+            ('', 'start_map'),
+            ('', 'map_key'),
+            ('.a', 'start_array'),
+            ('.a.item', 'number'),
+            ('.a', 'end_array'),
+            ('', 'end_map'),
+            ('', 'map_key'),
+            ('b', 'start_array'),
+            ('b.item', 'start_map'),
+            ('b.item', 'map_key'),
+            ('b.item.', 'start_array'),
+            ('b.item..item', 'number'),
+            ('b.item.', 'end_array'),
+            ('b.item', 'end_map'),
+            ('b', 'end_array'),
+            ('', 'end_map'),
+        ])
+        batches = list(common.parse_batches([list(basic_parse(StringIO(document)))]))
+        self.assertEqual([(prefix, event) for prefix, event, value in batches[0]], prefixes)
+
+    def test_select(self):
+        events = list(basic_parse(StringIO(SKIP_JSON), select='a.item.c'))
+        self.assertEqual(events, [
+            ('start_map', None),
+                ('map_key', 'a'),
+                ('start_array', None),
+                    ('start_map', None),
+                        ('map_key', 'c'),
+                        ('start_array', None),
+                            ('number', 1),
+                            ('start_map', None),
+                                ('map_key', 'd'),
+                                ('number', 2),
+                            ('end_map', None),
+                        ('end_array', None),
+                    ('end_map', None),
+                ('end_array', None),
+            ('end_map', None),
+        ])
+
     def test_scalar(self):
         events = list(parse(StringIO(SCALAR_JSON)))
         self.assertEqual(events, [('', 'number', 0)])
@@ -170,6 +264,32 @@ class Builder(unittest.TestCase):
             builder.event(event, value)
         self.assertEqual(builder.value, 0)
 
+    def test_container_factories(self):
+        builder = ObjectBuilder(map_type=list, array_type=tuple)
+        for event, value in basic_parse(StringIO('{"b": [1, {"c": []}], "a": {}}')):
+            builder.event(event, value)
+        self.assertEqual(builder.value, [
+            ('b', (1, [('c', ())])),
+            ('a', []),
+        ])
+
+    def test_array_factory(self):
+        builder = ObjectBuilder(array_type=tuple)
+        for event, value in basic_parse(StringIO('[{"a": [1, [2]]}, 3]')):
+            builder.event(event, value)
+        self.assertEqual(builder.value, ({'a': (1, (2,))}, 3))
+
+    def test_factory_items(self):
+        for backend in (pythonbackend, yajlbackend):
+            meta = list(backend.items(StringIO(JSON), 'docs.item.meta', map_type=list, array_type=tuple))
+            self.assertEqual(meta, [((1,), (2,)), [('key', u'value')], None])
+            found = list(backend.multi_items(StringIO(JSON), ['docs.item.meta', 'docs.item.meta.item'], array_type=tuple))
+            self.assertEqual(found[:3], [
+                ('docs.item.meta.item', (1,)),
+                ('docs.item.meta.item', (2,)),
+                ('docs.item.meta', ((1,), (2,))),
+            ])
+
     def test_items(self):
         meta = list(items(StringIO(JSON), 'docs.item.meta'))
         self.assertEqual(meta, [
@@ -178,6 +298,819 @@ class Builder(unittest.TestCase):
             None,
         ])
 
+    def test_multi_items(self):
+        found = list(multi_items(StringIO(JSON), ['docs.item.meta', 'docs.item.meta.item', 'docs.item.double']))
+        self.assertEqual(found, [
+            ('docs.item.double', Decimal('0.5')),
+            ('docs.item.meta.item', [1]),
+            ('docs.item.meta.item', [2]),
+            ('docs.item.meta', [[1], [2]]),
+            ('docs.item.meta', {'key': 'value'}),
+            ('docs.item.meta', None),
+        ])
+
+    def test_route_items(self):
+        found = {'e.f.item': [], 'h': []}
+        route_items(StringIO(SKIP_JSON), dict((k, v.append) for k, v in found.items()))
+        self.assertEqual(found, {'e.f.item': [3, 4], 'h': [5]})
+
+@utils.coroutine
+def collector(events):
+    while True:
+        events.append((yield))
+
+class Utils(unittest.TestCase):
+    def test_dispatcher(self):
+        found = dict((name, []) for name in ('c', 'a', 'e', 'rest'))
+        dispatcher = utils.dispatcher([
+            ('a.item.c', collector(found['c'])),
+            ('a', collector(found['a'])),
+            ('e.*', collector(found['e'])),
+            ('', collector(found['rest'])),
+        ])
+        events = list(parse(StringIO(SKIP_JSON)))
+        for event in events:
+            dispatcher.send(event)
+        self.assertEqual([value for prefix, event, value in found['c'] if event == 'number'], [1, 2])
+        self.assertTrue(all(prefix.startswith('a.item.c') for prefix, event, value in found['c']))
+        self.assertEqual(found['a'][0], ('a', 'start_array', None))
+        self.assertTrue(('a.item', 'map_key', 'c') in found['a'])
+        self.assertEqual(found['e'][0], ('e.f', 'start_array', None))
+        self.assertTrue(('e', 'map_key', 'f') in found['rest'])
+        self.assertEqual(sum(len(v) for v in found.values()), len(events))
+
+    def test_dispatcher_components(self):
+        found = []
+        dispatcher = utils.dispatcher([('ab', collector(found))])
+        for event in parse(StringIO('{"abc": 1, "ab": 2}')):
+            dispatcher.send(event)
+        self.assertEqual(found, [('ab', 'number', 2)])
+
+    def test_foreach(self):
+        found = []
+        @utils.coroutine
+        def builder():
+            builder = ObjectBuilder()
+            while True:
+                prefix, event, value = yield
+                builder.event(event, value)
+                if not builder.containers:
+                    found.append(builder.value)
+        foreach = utils.foreach(builder)
+        for event in parse(StringIO('[1, {"a": [2]}, [], "x"]')):
+            foreach.send(event)
+        self.assertEqual(found, [1, {'a': [2]}, [], 'x'])
+
+    def test_foreach_dispatcher(self):
+        found = []
+        foreach = utils.foreach(lambda: utils.dispatcher([('item.a', collector(found))]))
+        for event in parse(StringIO('[{"a": 1, "b": 2}, {"a": 3}]')):
+            foreach.send(event)
+        self.assertEqual(found, [('item.a', 'number', 1), ('item.a', 'number', 3)])
+
+    def test_foreach_dispatcher_dotted_keys(self):
+        found = []
+        foreach = utils.foreach(lambda: utils.dispatcher([(r'item.a\.b', collector(found))]))
+        for event in parse(StringIO('[{"a.b": 1, "a": {"b": 2}}]')):
+            foreach.send(event)
+        self.assertEqual(found, [('item.a.b', 'number', 1)])
+
+class Patterns(unittest.TestCase):
+    def test_matcher(self):
+        matcher = PrefixMatcher(['earth.*.item', 'docs.**', 'docs.item.meta'])
+        europe = matcher.root.child('earth').child('europe')
+        self.assertTrue(europe.alive)
+        self.assertEqual(europe.child('item').matches, ('earth.*.item',))
+        self.assertFalse(europe.child('item').child('name').alive)
+        self.assertFalse(matcher.root.child('moon').alive)
+        docs = matcher.root.child('docs')
+        self.assertEqual(docs.matches, ('docs.**',))
+        self.assertEqual(
+            docs.child('item').child('meta').matches,
+            ('docs.**', 'docs.item.meta'),
+        )
+        self.assertTrue(docs.child('item').child('x') is docs.child('y'))
+
+    def test_escapes(self):
+        self.assertEqual(common.split_pattern(r'a\.b.\*.*.**.\\'), ('a.b', '*', common.ANY_KEY, common.ANY_PATH, '\\'))
+        document = '{"a.b": 1, "a": {"b": 2, "*": 3, "c": 4}}'
+        self.assertEqual(list(items(StringIO(document), r'a\.b')), [1])
+        self.assertEqual(list(items(StringIO(document), 'a.b')), [2])
+        self.assertEqual(list(items(StringIO(document), r'a.\*')), [3])
+        self.assertEqual(list(items(StringIO(document), 'a.*')), [2, 3, 4])
+        self.assertEqual(list(pythonbackend.items(StringIO(document), r'a\.b')), [1])
+        matcher = PrefixMatcher([r'x.a\.b', 'x.a.c'])
+        self.assertEqual(matcher.find('x.a.b').matches, (r'x.a\.b',))
+        self.assertEqual(matcher.find('x.a.c').matches, ('x.a.c',))
+
+    def test_wildcard_items(self):
+        meta = list(items(StringIO(JSON), 'docs.*.meta'))
+        self.assertEqual(meta, [[[1], [2]], {'key': 'value'}, None])
+        self.assertEqual(
+            list(items(StringIO(SKIP_JSON), '*.*.*')),
+            [u']}"', [1, {'d': 2}], 3, 4],
+        )
+
+    def test_recursive_items(self):
+        found = list(multi_items(StringIO(SKIP_JSON), ['e.**']))
+        self.assertEqual(found, [
+            ('e.f.item', 3),
+            ('e.f.item', 4),
+            ('e.f', [3, 4]),
+            ('e.g', {}),
+            ('e', {'f': [3, 4], 'g': {}}),
+        ])
+
+    def test_overlapping_routes(self):
+        found = {'*': [], 'h': []}
+        route_items(StringIO(SKIP_JSON), dict((k, v.append) for k, v in found.items()))
+        self.assertEqual(found['h'], [5])
+        self.assertEqual(len(found['*']), 3)
+
+    def test_python_backend(self):
+        found = list(pythonbackend.multi_items(StringIO(JSON), ['docs.*.meta.*.*', 'docs.*.meta.key']))
+        self.assertEqual(found, [
+            ('docs.item.meta.item.item', 1),
+            ('docs.item.meta.item.item', 2),
+            ('docs.item.meta.key', 'value'),
+        ])
+
+class PythonSelect(unittest.TestCase):
+    def test_items(self):
+        meta = list(pythonbackend.items(StringIO(JSON), 'docs.item.meta'))
+        self.assertEqual(meta, [
+            [[1], [2]],
+            {'key': 'value'},
+            None,
+        ])
+
+    def test_multi_items(self):
+        found = list(pythonbackend.multi_items(StringIO(SKIP_JSON), ['e.f.item', 'h', 'e']))
+        self.assertEqual(found, [
+            ('e.f.item', 3),
+            ('e.f.item', 4),
+            ('e', {'f': [3, 4], 'g': {}}),
+            ('h', 5),
+        ])
+
+    def test_selected_events(self):
+        events = list(pythonbackend.basic_parse(StringIO(SKIP_JSON), select='e.f'))
+        self.assertEqual(events, [
+            ('start_map', None),
+                ('map_key', 'e'),
+                ('start_map', None),
+                    ('map_key', 'f'),
+                    ('start_array', None),
+                        ('number', 3),
+                        ('number', 4),
+                    ('end_array', None),
+                ('end_map', None),
+            ('end_map', None),
+        ])
+
+    def test_skip_across_buffers(self):
+        for buf_size in (1, 2, 3, 5):
+            self.assertEqual(
+                list(pythonbackend.items(StringIO(SKIP_JSON), 'h', buf_size=buf_size)),
+                [5],
+            )
+            self.assertEqual(
+                list(pythonbackend.items(StringIO(SKIP_JSON), 'a.item.c', buf_size=buf_size)),
+                [[1, {'d': 2}]],
+            )
+
+    def test_buffer_boundaries(self):
+        for document in (JSON, STRINGS_JSON, SKIP_JSON, r'["\\\\\\\"", 12345, true]'):
+            reference = list(pythonbackend.basic_parse(StringIO(document)))
+            for buf_size in range(1, 8):
+                events = list(pythonbackend.basic_parse(StringIO(document), buf_size=buf_size))
+                self.assertEqual(events, reference)
+
+    def test_skip_incomplete(self):
+        self.assertRaises(
+            IncompleteJSONError,
+            lambda: list(pythonbackend.items(StringIO('{"a": [1, "]'), 'b')),
+        )
+
+    def test_deep_nesting(self):
+        depth = sys.getrecursionlimit() * 2
+        document = '[' * depth + '{"a": 1}' + ']' * depth
+        events = list(pythonbackend.basic_parse(StringIO(document)))
+        self.assertEqual(len(events), depth * 2 + 4)
+        found = list(pythonbackend.items(StringIO(document), 'item.' * depth + 'a'))
+        self.assertEqual(found, [1])
+
+    def test_invalid_separators(self):
+        for document in ('[1, 2,]', '[1 2]', '{"a": 1,}', '{"a" 1}', '{"a": 1]', '[1}'):
+            for select in (None, ['a', 'item']):
+                self.assertRaises(
+                    JSONError,
+                    lambda: list(pythonbackend.basic_parse(StringIO(document), select=select)),
+                )
+
+NUMBERS_JSON = '[1, -2, 0.5, 1e3, 2.5E-1, 12345678901]'
+
+class Projection(unittest.TestCase):
+    def test_fields(self):
+        for backend in (pythonbackend, yajlbackend):
+            found = list(backend.items(StringIO(JSON), 'docs.item', fields=['integer', 'meta.item']))
+            self.assertEqual(found, [{'integer': 0}, {'meta': [[1], [2]]}, {'meta': {}}, {}])
+
+    def test_nested_fields(self):
+        for backend in (pythonbackend, yajlbackend):
+            found = list(backend.items(StringIO(SKIP_JSON), '', fields=['a.item.c.item.d', 'h']))
+            self.assertEqual(found, [{'a': [{'c': [{'d': 2}]}], 'h': 5}])
+
+    def test_scalars(self):
+        document = '[1, {"id": 2, "x": 3}, null, {"id": {"y": 4}}]'
+        for backend in (pythonbackend, yajlbackend):
+            found = list(backend.items(StringIO(document), 'item', fields=['id']))
+            self.assertEqual(found, [1, {'id': 2}, None, {'id': {'y': 4}}])
+            found = list(backend.items(StringIO(document), 'item', fields=['id.y']))
+            self.assertEqual(found, [1, {}, None, {'id': {'y': 4}}])
+        events = list(basic_parse(StringIO(document)))
+        found = list(common.items(events, 'item', fields=['id']))
+        self.assertEqual(found, [1, {'id': 2}, None, {'id': {'y': 4}}])
+
+    def test_events(self):
+        events = list(basic_parse(StringIO(JSON)))
+        found = list(common.items(events, 'docs.item', fields='meta'))
+        self.assertEqual(found, [{}, {'meta': [[1], [2]]}, {'meta': {'key': 'value'}}, {'meta': None}])
+        found = list(common.items(events, 'docs.item.*', fields=''))
+        self.assertEqual(len(found), 10)
+
+    def test_select(self):
+        events = list(basic_parse(StringIO(SKIP_JSON)))
+        for backend in (pythonbackend, yajlbackend):
+            for select in (['e.f', 'a.item.b'], ['**'], ['x'], ['a.item.c.item.d', 'e.f.item.x']):
+                matcher = PrefixMatcher(select)
+                self.assertEqual(
+                    list(common.select(events, matcher)),
+                    list(backend.basic_parse(StringIO(SKIP_JSON), select=matcher)),
+                )
+
+class MultipleValues(unittest.TestCase):
+    def test_values(self):
+        for backend in (pythonbackend, yajlbackend):
+            for buf_size in (1, 3, 1024):
+                events = list(backend.basic_parse(StringIO(MULTIPLE_JSON), buf_size=buf_size, multiple_values=True))
+                self.assertEqual(events, [
+                    ('start_map', None), ('map_key', 'a'), ('number', 1), ('end_map', None),
+                    ('start_array', None), ('number', 2), ('end_array', None),
+                    ('number', 3),
+                    ('string', u'x'),
+                    ('start_map', None), ('end_map', None),
+                ])
+
+    def test_items(self):
+        for backend in (pythonbackend, yajlbackend):
+            found = list(backend.items(StringIO(LINES_JSON), 'id', multiple_values=True))
+            self.assertEqual(found, [1, 2, 3])
+
+    def test_empty(self):
+        for backend in (pythonbackend, yajlbackend):
+            for json in (EMPTY_JSON, ' \n '):
+                self.assertEqual(list(backend.basic_parse(StringIO(json), multiple_values=True)), [])
+
+    def test_incomplete(self):
+        for backend in (pythonbackend, yajlbackend):
+            self.assertRaises(IncompleteJSONError, list, backend.basic_parse(StringIO('1 ['), multiple_values=True))
+
+    def test_lines(self):
+        batches = list(parallel.line_batches(StringIO(LINES_JSON), 10))
+        self.assertEqual(''.join(batches), LINES_JSON)
+        for batch in batches:
+            self.assertTrue(batch.endswith('\n'))
+        for backend in ('python', yajlbackend):
+            found = list(parallel.line_items(StringIO(LINES_JSON), 'id', backend, processes=1, batch_size=10))
+            self.assertEqual(found, [1, 2, 3])
+
+    def test_pool(self):
+        json = ''.join('{"id": %d}\n' % i for i in range(1000))
+        found = list(parallel.line_items(StringIO(json), 'id', processes=2, batch_size=100))
+        self.assertEqual(found, range(1000))
+        found = list(parallel.line_items(StringIO(json), 'id', processes=2, batch_size=100, ordered=False))
+        self.assertEqual(sorted(found), range(1000))
+
+class Numbers(unittest.TestCase):
+    def numbers(self, backend, policy):
+        return [
+            value for event, value
+            in backend.basic_parse(StringIO(NUMBERS_JSON), number=policy)
+            if event == 'number'
+        ]
+
+    def test_decimal(self):
+        for backend in (pythonbackend, yajlbackend):
+            numbers = self.numbers(backend, Decimal)
+            self.assertEqual(numbers, [1, -2, Decimal('0.5'), 1000, Decimal('0.25'), 12345678901])
+            self.assertEqual([type(n) for n in numbers[:3]], [int, int, Decimal])
+
+    def test_float(self):
+        for backend in (pythonbackend, yajlbackend):
+            numbers = self.numbers(backend, float)
+            self.assertEqual(numbers, [1, -2, 0.5, 1000.0, 0.25, 12345678901])
+            self.assertEqual([type(n) for n in numbers[:3]], [int, int, float])
+
+    def test_raw(self):
+        for backend in (pythonbackend, yajlbackend):
+            numbers = self.numbers(backend, RawNumber)
+            self.assertEqual([n.text for n in numbers], ['1', '-2', '0.5', '1e3', '2.5E-1', '12345678901'])
+            self.assertEqual(numbers[2], Decimal('0.5'))
+            self.assertEqual(float(numbers[4]), 0.25)
+            self.assertEqual(int(numbers[5]), 12345678901)
+
+    def test_float_big_integer(self):
+        for backend in (pythonbackend, yajlbackend):
+            events = backend.basic_parse(StringIO('[12345678901234567890123, 1.5]'), number=float)
+            numbers = [value for event, value in events if event == 'number']
+            self.assertEqual(numbers, [12345678901234567890123, 1.5])
+
+    def test_raw_invalid(self):
+        for backend in (pythonbackend, yajlbackend):
+            for document in ('[nul]', '[abc]', '[tru]', '[1-2-3]', '[01]', '[1.]'):
+                events = backend.basic_parse(StringIO(document), number=RawNumber)
+                self.assertRaises(common.JSONError, list, events)
+
+    def test_unknown_policy(self):
+        for backend in (pythonbackend, yajlbackend):
+            self.assertRaises(ValueError, lambda: self.numbers(backend, int))
+
+class Strings(unittest.TestCase):
+    def test_unescaped(self):
+        document = '["\xd1\x81\xd1\x82", "\xd1\x81\\n\\u0442", "plain"]'
+        for backend in (pythonbackend, yajlbackend):
+            self.assertEqual(
+                list(backend.items(StringIO(document), 'item')),
+                [u'\u0441\u0442', u'\u0441\n\u0442', u'plain'],
+            )
+
+    def test_interned_keys(self):
+        document = '[{"key": 1, "other": 2}, {"key": 3, "other": 4}]'
+        for backend in (pythonbackend, yajlbackend):
+            first, second = backend.items(StringIO(document), 'item', intern_keys=1)
+            keys = dict((k, k) for k in first)
+            self.assertTrue(keys['key'] is [k for k in second if k == 'key'][0])
+            self.assertFalse(keys['other'] is [k for k in second if k == 'other'][0])
+
+class MappedFiles(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, JSON)
+        os.close(fd)
+        fd, self.empty = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.empty)
+
+    def test_path(self):
+        for backend in (pythonbackend, yajlbackend):
+            reference = list(backend.basic_parse(StringIO(JSON)))
+            self.assertEqual(list(backend.basic_parse(self.path)), reference)
+            self.assertEqual(list(backend.basic_parse(self.path, buf_size=5)), reference)
+
+    def test_mmap(self):
+        f = open(self.path, 'rb')
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for backend in (pythonbackend, yajlbackend):
+                meta = list(backend.items(mapping, 'docs.item.meta', buf_size=7))
+                self.assertEqual(meta, [[[1], [2]], {'key': 'value'}, None])
+        finally:
+            mapping.close()
+            f.close()
+
+    def test_empty(self):
+        for backend in (pythonbackend, yajlbackend):
+            self.assertRaises(
+                IncompleteJSONError,
+                lambda: list(backend.basic_parse(self.empty)),
+            )
+
+class Parallel(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, JSON)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_locate(self):
+        for buf_size in (1, 5, 1024):
+            spans = list(pythonbackend.locate(StringIO(SKIP_JSON), '*.*.*', buf_size=buf_size))
+            self.assertEqual(
+                [(path, SKIP_JSON[start:end]) for path, start, end in spans],
+                [('a.item.b', '"]}\\""'), ('a.item.c', '[1, {"d": 2}]'), ('e.f.item', '3'), ('e.f.item', '4')],
+            )
+        spans = list(pythonbackend.locate(self.path, 'docs.item.meta'))
+        self.assertEqual([JSON[start:end] for path, start, end in spans], ['[[1], [2]]', '{"key": "value"}', 'null'])
+
+    def test_items(self):
+        for backend in ('python', yajlbackend):
+            for prefix in ('docs.item', 'docs.*.meta.item'):
+                reference = list(items(StringIO(JSON), prefix))
+                found = list(parallel.items(self.path, prefix, backend, processes=1, batch_size=10))
+                self.assertEqual(found, reference)
+        f = open(self.path, 'rb')
+        try:
+            found = list(parallel.items(f, 'docs.item', processes=2, batch_size=1, fields=['meta']))
+        finally:
+            f.close()
+        self.assertEqual(found, [{}, {'meta': [[1], [2]]}, {'meta': {'key': 'value'}}, {'meta': None}])
+
+class Indexes(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, JSON)
+        os.close(fd)
+        self.index_path = self.path + '.idx'
+
+    def tearDown(self):
+        os.remove(self.path)
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def test_index(self):
+        reference = list(items(StringIO(JSON), 'docs.*.meta'))
+        index.build(self.path, 'docs.*.meta').save(self.index_path)
+        loaded = index.load(self.index_path)
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(loaded.path(2), 'docs.item.meta')
+        f = open(self.path, 'rb')
+        try:
+            for backend in (pythonbackend, yajlbackend):
+                self.assertEqual(loaded.item(f, 1, backend), reference[1])
+                self.assertEqual(loaded.item(f, -1, backend), reference[-1])
+                self.assertEqual(list(loaded.items(f, 1, backend=backend)), reference[1:])
+                self.assertEqual(list(loaded.items(f, 0, 2, backend, array_type=tuple)), [((1,), (2,)), {'key': 'value'}])
+            self.assertRaises(IndexError, loaded.item, f, 3)
+        finally:
+            f.close()
+
+    def test_large_offsets(self):
+        built = index.build(StringIO(JSON), 'docs.item')
+        built.starts[0] = 2 ** 40
+        built.ends[0] = 2 ** 40 + 10
+        built.save(self.index_path)
+        self.assertEqual(index.load(self.index_path).span(0), (2 ** 40, 2 ** 40 + 10))
+
+    def test_stale(self):
+        built = index.build(StringIO(JSON), 'docs.item')
+        self.assertEqual(built.size, None)
+        built.size = len(JSON) + 1
+        f = open(self.path, 'rb')
+        try:
+            self.assertRaises(ValueError, built.item, f, 0)
+        finally:
+            f.close()
+
+class Checkpoints(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, SKIP_JSON)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_resume(self):
+        events = list(pythonbackend.parse(StringIO(SKIP_JSON)))
+        for backend in (pythonbackend, yajlbackend):
+            for prefix in ('a.item', 'e.*', 'e.f.item', '**.d'):
+                reference = list(backend.items(StringIO(SKIP_JSON), prefix))
+                found = checkpoint.items(self.path, prefix, backend=backend, batch_size=1)
+                tokens = []
+                for value in found:
+                    tokens.append(found.token)
+                self.assertEqual(len(tokens), len(reference))
+                for i, token in enumerate(tokens):
+                    f = open(self.path, 'rb')
+                    try:
+                        resumed = list(checkpoint.items(f, prefix, token=token, backend=backend))
+                    finally:
+                        f.close()
+                    self.assertEqual(resumed, reference[i + 1:])
+                    rest = list(checkpoint.parse(self.path, token, backend))
+                    self.assertEqual(rest, events[len(events) - len(rest):])
+
+    def test_token(self):
+        found = checkpoint.items(self.path, 'e.f.item')
+        self.assertEqual(found.token, None)
+        self.assertEqual(list(found), [3, 4])
+        offset, keys = checkpoint.decode_token(found.token)
+        self.assertEqual(SKIP_JSON[offset - 1], '4')
+        self.assertEqual(keys, ['e', 'f', None])
+        self.assertEqual(checkpoint.prelude(keys), '{"e":{"f":[')
+
+class Statistics(unittest.TestCase):
+    def test_counts(self):
+        for backend in (pythonbackend, yajlbackend):
+            stats = Stats()
+            list(backend.basic_parse(StringIO(JSON), stats=stats))
+            self.assertEqual(stats.bytes, len(JSON))
+            self.assertEqual(stats.events['start_map'], 6)
+            self.assertEqual(stats.events['number'], 6)
+            self.assertEqual(stats.events['end_array'], 4)
+            self.assertEqual(stats.max_depth, 5)
+            self.assertEqual(stats.depth, 0)
+            self.assertEqual(stats.times['basic_parse'], 0)
+
+    def test_items(self):
+        for backend in (pythonbackend, yajlbackend):
+            stats = Stats(timing=True)
+            found = list(backend.items(StringIO(JSON), 'docs.item.meta', stats=stats))
+            self.assertEqual(stats.items, len(found))
+            self.assertTrue(stats.times['items'] >= stats.times['basic_parse'] > 0)
+            self.assertEqual(sorted(stats.breakdown()), ['build', 'parse', 'prefixes', 'read'])
+
+    def test_parse(self):
+        stats = Stats(timing=True)
+        events = list(pythonbackend.parse(StringIO(JSON), stats=stats))
+        self.assertEqual(sum(stats.events.values()), len(events))
+        self.assertTrue(stats.times['parse'] > 0)
+
+class FailingFile(object):
+    def __init__(self, data):
+        self.f = StringIO(data)
+
+    def read(self, size):
+        data = self.f.read(size)
+        if not data:
+            raise IOError('Connection reset')
+        return data
+
+class Streams(unittest.TestCase):
+    def test_read_ahead(self):
+        for backend in (pythonbackend, yajlbackend):
+            f = streams.ReadAhead(StringIO(JSON), chunk_size=7, depth=2)
+            try:
+                self.assertEqual(list(backend.basic_parse(f)), list(backend.basic_parse(StringIO(JSON))))
+            finally:
+                f.close()
+
+    def test_sizes(self):
+        f = streams.ReadAhead(StringIO(JSON), chunk_size=10)
+        pieces = [f.read(3), f.read(20), f.read()]
+        self.assertEqual(''.join(pieces), JSON)
+        self.assertEqual([len(p) for p in pieces[:2]], [3, 7])
+        self.assertEqual(f.read(), '')
+        f.close()
+
+    def test_error(self):
+        f = streams.ReadAhead(FailingFile(JSON), chunk_size=10)
+        self.assertRaises(IOError, list, pythonbackend.basic_parse(f))
+        f.close()
+
+    def test_close(self):
+        f = streams.ReadAhead(StringIO(JSON * 100), chunk_size=1, depth=1)
+        f.read(1)
+        f.close()
+        self.assertFalse(f.thread.is_alive())
+
+class Compressed(unittest.TestCase):
+    def setUp(self):
+        buf = StringIO()
+        for part in (JSON[:100], JSON[100:]):
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(part)
+            f.close()
+        self.gzipped = buf.getvalue()
+        self.bzipped = bz2.compress(JSON)
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, self.gzipped)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_formats(self):
+        reference = list(pythonbackend.basic_parse(StringIO(JSON)))
+        for backend in (pythonbackend, yajlbackend):
+            for data in (self.gzipped, self.bzipped):
+                for thread in (False, True):
+                    events = backend.basic_parse(StringIO(data), buf_size=16, decompress_in_thread=thread)
+                    self.assertEqual(list(events), reference)
+            self.assertEqual(list(backend.basic_parse(self.path)), reference)
+
+    def test_reads(self):
+        f = streams.Decompressed(StringIO(self.bzipped), 'bz2', chunk_size=10)
+        self.assertEqual([len(f.read(50)) for i in range(3)], [50, 50, 50])
+        self.assertEqual(f.read(), JSON[150:])
+        self.assertEqual(f.read(10), '')
+
+    def test_detection(self):
+        self.assertEqual(streams.compression(self.gzipped), 'gzip')
+        self.assertEqual(streams.compression(self.bzipped), 'bz2')
+        self.assertEqual(streams.compression(JSON), None)
+        f, close = streams.open_input(StringIO(SCALAR_JSON))
+        self.assertEqual((f.read(), close), (SCALAR_JSON, None))
+
+def push(coroutine, data, size):
+    for i in xrange(0, len(data), size):
+        coroutine.send(data[i:i + size])
+    coroutine.send('')
+
+class Push(unittest.TestCase):
+    def test_basic_parse(self):
+        for backend in (pythonbackend, yajlbackend):
+            for document in (JSON, SKIP_JSON, STRINGS_JSON, SCALAR_JSON, r'[1, 2.5e3, true, "\\\""]'):
+                reference = list(backend.basic_parse(StringIO(document)))
+                for size in (1, 2, 3, 7, 1000):
+                    events = utils.SendableList()
+                    push(backend.basic_parse_coro(events), document, size)
+                    self.assertEqual(events, reference)
+
+    def test_events_arrive_early(self):
+        for backend in (pythonbackend, yajlbackend):
+            found = utils.SendableList()
+            parser = backend.items_coro(found, 'item')
+            parser.send('[{"id": 1}, {"id"')
+            self.assertEqual(found, [{'id': 1}])
+            parser.send(': 2}]')
+            self.assertEqual(found, [{'id': 1}, {'id': 2}])
+            parser.send('')
+
+    def test_parse_and_items(self):
+        for backend in (pythonbackend, yajlbackend):
+            events = utils.SendableList()
+            push(backend.parse_coro(events), JSON, 10)
+            self.assertEqual(events, list(parse(StringIO(JSON))))
+            found = utils.SendableList()
+            push(backend.items_coro(found, 'docs.item.meta'), JSON, 10)
+            self.assertEqual(found, list(items(StringIO(JSON), 'docs.item.meta')))
+
+    def test_patterns(self):
+        for prefix in ('docs.item', 'docs.*.meta', 'docs.**', ['docs', 'docs.item.meta.item']):
+            found = utils.SendableList()
+            push(pythonbackend.items_coro(found, prefix), JSON, 10)
+            self.assertEqual(found, list(pythonbackend.items(StringIO(JSON), prefix)))
+
+    def test_multiple_values(self):
+        for backend in (pythonbackend, yajlbackend):
+            events = utils.SendableList()
+            push(backend.basic_parse_coro(events, multiple_values=True), MULTIPLE_JSON, 3)
+            self.assertEqual(events, list(backend.basic_parse(StringIO(MULTIPLE_JSON), multiple_values=True)))
+
+    def test_escaped_quotes(self):
+        document = r'["%s", "\\", {"\\\"": "\"\\\""}]' % (r'a\"b\\c\\\"' * 100)
+        reference = list(pythonbackend.basic_parse(StringIO(document)))
+        for size in (1, 2, 3, 5, 8, 64):
+            events = utils.SendableList()
+            push(pythonbackend.basic_parse_coro(events), document, size)
+            self.assertEqual(events, reference)
+
+    def test_long_string_lexed_once(self):
+        # a pending string is only scanned for its end as chunks arrive
+        # and lexed once it's complete, whatever quotes it contains
+        calls = []
+        lexems = pythonbackend.lexems
+        def counting_lexems(data, final):
+            calls.append(len(data))
+            return lexems(data, final)
+        pythonbackend.lexems = counting_lexems
+        try:
+            events = utils.SendableList()
+            push(pythonbackend.basic_parse_coro(events), '["%s"]' % (r'\"' * 10000), 10)
+        finally:
+            pythonbackend.lexems = lexems
+        self.assertEqual(events[1], ('string', u'"' * 10000))
+        self.assertTrue(len(calls) <= 4)
+
+    def test_incomplete(self):
+        for backend in (pythonbackend, yajlbackend):
+            for document in (EMPTY_JSON, INCOMPLETE_JSON, '[1, 2'):
+                parser = backend.basic_parse_coro(utils.SendableList())
+                self.assertRaises(IncompleteJSONError, push, parser, document, 2)
+
+    def test_invalid(self):
+        for backend in (pythonbackend, yajlbackend):
+            parser = backend.basic_parse_coro(utils.SendableList())
+            self.assertRaises(JSONError, push, parser, INVALID_JSON, 2)
+
+class Batches(unittest.TestCase):
+    def test_basic_parse_batches(self):
+        for backend in (pythonbackend, yajlbackend):
+            for document in (JSON, SKIP_JSON, SCALAR_JSON):
+                batches = list(backend.basic_parse_batches(StringIO(document)))
+                self.assertEqual(sum(batches, []), list(backend.basic_parse(StringIO(document))))
+
+    def test_parse_batches(self):
+        for backend in (pythonbackend, yajlbackend):
+            batches = list(backend.parse_batches(StringIO(JSON)))
+            self.assertEqual(sum(batches, []), list(parse(StringIO(JSON))))
+
+    def test_batch_sizes(self):
+        batches = list(yajlbackend.basic_parse_batches(StringIO(JSON), buf_size=32))
+        self.assertTrue(len(batches) > 1)
+        batches = list(pythonbackend.basic_parse_batches(StringIO(JSON), batch_size=10))
+        self.assertEqual([len(batch) for batch in batches[:-1]], [10] * (len(batches) - 1))
+
+    def test_incomplete(self):
+        for backend in (pythonbackend, yajlbackend):
+            self.assertRaises(
+                IncompleteJSONError,
+                lambda: list(backend.basic_parse_batches(StringIO(INCOMPLETE_JSON))),
+            )
+
+LONG_STRINGS_JSON = r'''
+{
+  "short": "x",
+  "long": "%s",
+  "skipped": ["%s"],
+  "%s": 1
+}
+''' % (r'\"abc\\т\n' * 20 + 'строка', 'y' * 100, 'k' * 30)
+
+def join_strings(events):
+    result = []
+    for event, value in events:
+        if event == 'start_string':
+            pieces = []
+        elif event == 'string_chunk':
+            pieces.append(value)
+        elif event == 'end_string':
+            result.append(('string', u''.join(pieces)))
+        else:
+            result.append((event, value))
+    return result
+
+class LongStrings(unittest.TestCase):
+    def test_chunks(self):
+        reference = list(pythonbackend.basic_parse(StringIO(LONG_STRINGS_JSON)))
+        for buf_size in (1, 2, 5, 64):
+            events = list(pythonbackend.basic_parse(
+                StringIO(LONG_STRINGS_JSON), buf_size=buf_size, max_string_size=10,
+            ))
+            self.assertTrue(('string', u'x') in events)
+            self.assertTrue(len([e for e in events if e[0] == 'string_chunk']) > 1)
+            self.assertEqual(join_strings(events), reference)
+
+    def test_sink(self):
+        sinks = []
+        def sink():
+            sinks.append(StringIO())
+            return sinks[-1]
+        found = list(pythonbackend.items(
+            StringIO(LONG_STRINGS_JSON), 'long', max_string_size=10, string_sink=sink,
+        ))
+        self.assertEqual(found, sinks)
+        reference = list(pythonbackend.items(StringIO(LONG_STRINGS_JSON), 'long'))
+        self.assertEqual(found[0].getvalue().decode('utf-8'), reference[0])
+
+    def test_skipped(self):
+        events = list(pythonbackend.basic_parse(
+            StringIO(LONG_STRINGS_JSON), select=['short', 'k' * 30], max_string_size=10, buf_size=7,
+        ))
+        self.assertEqual(events, list(pythonbackend.basic_parse(
+            StringIO(LONG_STRINGS_JSON), select=['short', 'k' * 30],
+        )))
+
+    def test_items_need_sink(self):
+        self.assertRaises(
+            ValueError,
+            lambda: pythonbackend.items(StringIO(LONG_STRINGS_JSON), 'long', max_string_size=10),
+        )
+
+if aio.trollius is not None:
+    class Async(unittest.TestCase):
+        def setUp(self):
+            self.loop = aio.trollius.new_event_loop()
+
+        def tearDown(self):
+            self.loop.close()
+
+        def collect(self, parsed, data):
+            reader = aio.trollius.StreamReader(loop=self.loop)
+            for i in xrange(0, len(data), 10):
+                reader.feed_data(data[i:i + 10])
+            reader.feed_eof()
+            parsed.reader = reader
+            @aio.trollius.coroutine
+            def collect():
+                result = []
+                while True:
+                    batch = yield aio.From(parsed.next_batch())
+                    if batch is None:
+                        raise aio.Return(result)
+                    result.extend(batch)
+            return self.loop.run_until_complete(collect())
+
+        def test_items(self):
+            for backend in ('python', yajlbackend):
+                parsed = aio.items_async(None, 'docs.item.meta', backend=backend, buf_size=7)
+                self.assertEqual(self.collect(parsed, JSON), list(items(StringIO(JSON), 'docs.item.meta')))
+
+        def test_executor(self):
+            parsed = aio.parse_async(None, buf_size=7, executor=True, loop=self.loop)
+            self.assertEqual(self.collect(parsed, JSON), list(parse(StringIO(JSON))))
+
+        def test_incomplete(self):
+            parsed = aio.basic_parse_async(None, buf_size=7)
+            self.assertRaises(IncompleteJSONError, self.collect, parsed, INCOMPLETE_JSON)
+
 class FuncThread(threading.Thread):
     def __init__(self, func):
         super(FuncThread, self).__init__()